@@ -1,5 +1,6 @@
 import cv2, numpy as np
 import math
+import pyramid
 from collections import deque
 
 TAU = math.pi * 2
@@ -225,13 +226,30 @@ class DetectionWindow(object):
         return True
 
 def calc_flow(last_frame, curr_frame):
-    frame_h, frame_w = curr_frame.shape
-    new_size = (int(frame_w/2), int(frame_h/2))
-
-    last = cv2.resize(last_frame, new_size)
-    curr = cv2.resize(curr_frame, new_size)
+    # frames can be pyramid.FramePyramids, so their half size levels are reused
+    last = pyramid.as_pyramid(last_frame).level(1)
+    curr = pyramid.as_pyramid(curr_frame).level(1)
     return cv2.calcOpticalFlowFarneback(last, curr, None, 0.5, 3, 15, 3, 5, 1.2, 0)
 
+def calc_camera_flow(last_frames, curr_frames, rects, dimensions):
+    # calculates the optic flow of each camera's own frames (or pyramids), placed into
+    # a flow field for the whole composite (at the same low sample rate as calc_flow)
+    frame_w, frame_h = dimensions
+    flow = np.zeros((int(frame_h/2), int(frame_w/2), 2), dtype=np.float32)
+
+    for last_frame, curr_frame, (x1, y1, x2, y2) in zip(last_frames, curr_frames, rects):
+        if last_frame is None or curr_frame is None or last_frame.shape != curr_frame.shape:
+            continue
+
+        cam_flow = calc_flow(last_frame, curr_frame)
+
+        x1, y1 = int(x1/2), int(y1/2)
+        cam_h = min(cam_flow.shape[0], flow.shape[0] - y1)
+        cam_w = min(cam_flow.shape[1], flow.shape[1] - x1)
+        flow[y1:y1+cam_h, x1:x1+cam_w] = cam_flow[:cam_h, :cam_w]
+
+    return flow
+
 def detect_movement_in_rect(flow, rect, bounds, step=8, threshold=3, resolution=0.5):
     max_w, max_h = bounds
     x1, y1, x2, y2 = rect
@@ -1,5 +1,12 @@
 import cv2
 import numpy as np
+import raw_video
+import atexit
+import multiprocessing
+import threading
+import time
+from collections import deque
+from multiprocessing import shared_memory
 from time import sleep
 
 DEFAULT_CAP_PROPS = {
@@ -14,6 +21,12 @@ TESTING_CAP_PROPS = {
    cv2.CAP_PROP_FPS: 25
 }
 
+def open_source(source):
+   # raw video files are read through a memory map, anything else through OpenCV
+   if raw_video.is_raw_video(source):
+      return raw_video.RawVideoCapture(source)
+   return cv2.VideoCapture(source)
+
 def capture_image(filename):
    return cv2.imread(filename)
 
@@ -34,90 +47,806 @@ def capture_on_key(capture_keys=None, all_frames=False, quit_key='q'):
 
    video_capture.release()
 
-def greyscale(img):
-   grey_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+class ThreadedCapture(object):
+   """ Drains a cv2.VideoCapture on its own thread into a ring buffer of the newest frames
+
+   A juggled capture only grabs frames, without decoding them, except for the
+   one frame after each request(), so cameras that are read in turn don't cost
+   a decode per frame between their turns.
+   """
+   def __init__(self, capture, buffer_size=2, process=None, juggled=False):
+      self.capture = capture
+      self.process = process
+      self.buffer = deque(maxlen=buffer_size)
+      self.lock = threading.Lock()
+
+      # the first frame is always decoded, and every frame unless juggled
+      self.juggled = juggled
+      self.wanted = threading.Event()
+      self.wanted.set()
+
+      # frames_captured counts every frame read from the camera,
+      # frames_dropped counts the frames that were never handed out by latest()
+      self.frames_captured = 0
+      self.frames_dropped = 0
+      self.last_read_index = 0
+
+      self.running = True
+      self.thread = threading.Thread(target=self._run)
+      self.thread.daemon = True
+      self.thread.start()
+
+   def _run(self):
+      while self.running:
+         if self.juggled and not self.wanted.is_set():
+            # keep the camera's queue drained, so the next requested frame is a new one
+            is_captured = self.capture.grab()
+            frame = None
+         else:
+            # a request made while this frame decodes is for the one after
+            self.wanted.clear()
+            is_captured, frame = self.capture.read()
+         timestamp = time.time()
+
+         if not is_captured:
+            if not self.capture.isOpened():
+               break
+            sleep(0.005)
+            continue
+
+         if frame is None:
+            with self.lock:
+               self.frames_captured += 1
+            continue
+
+         if self.process is not None:
+            frame = self.process(frame)
+
+         with self.lock:
+            self.frames_captured += 1
+            self.buffer.append((self.frames_captured, timestamp, frame))
+
+   def request(self):
+      # decode the next frame, for a juggled capture's coming turn
+      self.wanted.set()
+
+   def latest(self):
+      # returns (index, timestamp, frame) of the newest frame, without waiting
+      with self.lock:
+         if len(self.buffer) == 0:
+            return None
+         index, timestamp, frame = self.buffer[-1]
+
+         if index > self.last_read_index + 1:
+            self.frames_dropped += index - self.last_read_index - 1
+         self.last_read_index = max(index, self.last_read_index)
+
+      return (index, timestamp, frame)
+
+   def read(self):
+      latest = self.latest()
+      if latest is None:
+         return False, None
+      return True, latest[2]
+
+   def set(self, prop, value):
+      return self.capture.set(prop, value)
+
+   def get(self, prop):
+      return self.capture.get(prop)
+
+   def isOpened(self):
+      return self.capture.isOpened()
+
+   def release(self):
+      self.running = False
+      self.thread.join(1.0)
+      self.capture.release()
+
+# bytes reserved at the start of a ProcessCapture's shared memory for:
+# the latest frame's sequence number, and a timestamp for each of the two frame slots
+SHARED_HEADER_SIZE = 64
+
+# times ProcessCapture.latest() copies a frame again, if the worker overtook the copy
+MAX_READ_ATTEMPTS = 3
+
+def map_shared_frames(shm, shape):
+   # views a shared memory segment as (sequence, timestamps, frame slots), without copying
+   frame_size = int(np.prod(shape))
+   sequence = np.ndarray((1,), dtype=np.int64, buffer=shm.buf, offset=0)
+   timestamps = np.ndarray((2,), dtype=np.float64, buffer=shm.buf, offset=8)
+   slots = [
+      np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=SHARED_HEADER_SIZE + i * frame_size)
+      for i in range(2)
+   ]
+   return sequence, timestamps, slots
+
+def capture_worker(cam_props, cv_props, shm_name, shape, running):
+   # runs in a capture process, decoding frames into the shared double buffer
+   shm = shared_memory.SharedMemory(name=shm_name)
+   sequence, timestamps, slots = map_shared_frames(shm, shape)
+
+   capture = open_source(cam_props['source'])
+   for prop in cv_props:
+      capture.set(prop, cv_props[prop])
+
+   index = 0
+
+   try:
+      while running.is_set():
+         is_captured, frame = capture.read()
+         timestamp = time.time()
+
+         if not is_captured:
+            if not capture.isOpened():
+               break
+            sleep(0.005)
+            continue
+
+         frame = prepare_frame(cam_props, frame)
+
+         # write to the slot not being read, then publish it
+         index += 1
+         slot = index % 2
+         np.copyto(slots[slot], frame)
+         timestamps[slot] = timestamp
+         sequence[0] = index
+   except KeyboardInterrupt:
+      pass
+   finally:
+      capture.release()
+      del sequence, timestamps, slots
+      shm.close()
+
+class ProcessCapture(object):
+   """ Captures a camera in its own process, sharing decoded frames through shared memory
+
+   The worker writes into a double buffer, and latest() copies the newest
+   complete frame out of it, so frames can be held on to (as the previous or
+   juggled frame) while the worker carries on writing.
+   """
+   def __init__(self, cam_props, cv_props):
+      placed = cam_props['placement']
+      frame_w, frame_h = placed['size']
+
+      if cam_props.get('grey', False):
+         self.shape = (frame_h, frame_w)
+      else:
+         self.shape = (frame_h, frame_w, 3)
+
+      frame_size = int(np.prod(self.shape))
+      self.shm = shared_memory.SharedMemory(create=True, size=SHARED_HEADER_SIZE + 2 * frame_size)
+      self.sequence, self.timestamps, self.slots = map_shared_frames(self.shm, self.shape)
+      self.sequence[0] = 0
+
+      self.frames_dropped = 0
+      self.last_read_index = 0
+
+      # only the settings the worker needs, the rest may not be picklable
+      worker_props = dict((key, cam_props.get(key)) for key in ('source', 'resolution', 'crop', 'grey', 'placement'))
+
+      self.running = multiprocessing.Event()
+      self.running.set()
+      self.process = multiprocessing.Process(target=capture_worker, args=(worker_props, cv_props, self.shm.name, self.shape, self.running))
+      self.process.daemon = True
+      self.process.start()
+
+      # make sure the segment is removed, even if release() is never called
+      atexit.register(self.release)
+
+   @property
+   def frames_captured(self):
+      if self.sequence is None:
+         return self.last_read_index
+      return int(self.sequence[0])
+
+   def latest(self):
+      # returns (index, timestamp, frame) of the newest frame, without waiting
+      if self.sequence is None:
+         return None
+
+      index = int(self.sequence[0])
+      if index == 0:
+         return None
+
+      for attempt in range(MAX_READ_ATTEMPTS):
+         slot = index % 2
+         timestamp = float(self.timestamps[slot])
+         frame = self.slots[slot].copy()
+
+         # the worker only rewrites this slot two frames on, which would tear the copy
+         newest = int(self.sequence[0])
+         if newest < index + 2:
+            break
+         index = newest
+
+      if index > self.last_read_index + 1:
+         self.frames_dropped += index - self.last_read_index - 1
+      self.last_read_index = max(index, self.last_read_index)
+
+      return (index, timestamp, frame)
+
+   def read(self):
+      latest = self.latest()
+      if latest is None:
+         return False, None
+      return True, latest[2]
+
+   def isOpened(self):
+      return self.process.is_alive()
+
+   def release(self):
+      if self.shm is None:
+         return
+
+      self.running.clear()
+      self.process.join(2.0)
+      if self.process.is_alive():
+         self.process.terminate()
+         self.process.join()
+
+      self.sequence = self.timestamps = self.slots = None
+
+      shm = self.shm
+      self.shm = None
+      shm.unlink()
+      try:
+         shm.close()
+      except BufferError:
+         # frames are still being viewed elsewhere, the mapping goes when they do
+         pass
+
+class ReplayClock(object):
+   """ Keeps replayed sources in lockstep
+
+   In 'fast' mode every tick moves on one frame, as fast as frames are asked for.
+   In 'realtime' mode ticks follow the recorded frame rate, skipping frames
+   when processing falls behind and waiting when it is ahead.
+   """
+   def __init__(self, mode='fast', fps=25.0):
+      if mode not in ('fast', 'realtime'):
+         raise ValueError('Unknown replay mode: %s' % mode)
+
+      self.mode = mode
+      self.fps = fps
+      self.frame_index = -1
+      self.start_time = None
+
+   def tick(self):
+      now = time.time()
+
+      if self.start_time is None:
+         self.start_time = now
+
+      if self.mode == 'fast':
+         self.frame_index += 1
+      else:
+         index = int((now - self.start_time) * self.fps)
+         if index <= self.frame_index:
+            # ahead of the recording, wait for the next frame to be due
+            index = self.frame_index + 1
+            sleep(max(0, self.frame_time(index) - now))
+         self.frame_index = index
+
+      return self.frame_index
+
+   def frame_time(self, index):
+      # when a frame was due to be captured, had the recording been live
+      return self.start_time + index / float(self.fps)
+
+class ReplayCapture(object):
+   """ Plays back a recorded file frame-accurately, at the frame its clock is on """
+   def __init__(self, source, clock):
+      self.capture = open_source(source)
+      self.clock = clock
+      self.position = -1
+      self.finished = False
+      self.timestamp = None
+
+   def read(self):
+      index = self.clock.frame_index
+
+      # skip (without decoding) any frames the clock has moved past
+      while self.position < index - 1 and not self.finished:
+         self.finished = not self.capture.grab()
+         self.position += 1
+
+      if self.finished or self.position >= index:
+         return False, None
+
+      is_captured, frame = self.capture.read()
+      self.position += 1
+
+      if not is_captured:
+         self.finished = True
+         return False, None
+
+      if self.clock.mode == 'realtime':
+         self.timestamp = self.clock.frame_time(index)
+      else:
+         self.timestamp = time.time()
+
+      return True, frame
+
+   def get(self, prop):
+      return self.capture.get(prop)
+
+   def set(self, prop, value):
+      return False
+
+   def isOpened(self):
+      return not self.finished and self.capture.isOpened()
+
+   def release(self):
+      self.capture.release()
+
+class Compositor(object):
+   """ Blends camera frames into a shared canvas, without per-frame allocation
+
+   Camera placements and blend ramps are precomputed once. Blend ramps are
+   applied through a per-column lookup table, and overlapping cameras are
+   summed with saturating uint8 adds, giving exactly the values of the float
+   implementation (blend_frames), bright overlaps clipped at 255 included.
+
+   Output alternates between two buffers, so a returned frame stays valid
+   until the next-but-one call to composite().
+   """
+   def __init__(self, cameras, dimensions, offset, channels=3):
+      w, h = dimensions
+      min_x, min_y = offset
+
+      if channels == 1:
+         shape = (h, w)
+      else:
+         shape = (h, w, channels)
+
+      self.buffers = [np.zeros(shape, dtype=np.uint8) for i in range(2)]
+      self.buffer_index = 0
+
+      rects = []
+      for cam_props in cameras:
+         placed = get_placement(cam_props)
+         cam_x, cam_y = placed['offset']
+         cam_w, cam_h = placed['size']
+         cam_x -= min_x
+         cam_y -= min_y
+         rects.append((cam_x, cam_y, cam_x + cam_w, cam_y + cam_h))
+
+      def overlaps(a, b):
+         return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+      # overlapping cameras are summed, so the canvas must be cleared every frame
+      self.clear = any(overlaps(a, b) for i, a in enumerate(rects) for b in rects[i+1:])
+
+      self.placements = []
+      for i, cam_props in enumerate(cameras):
+         x1, y1, x2, y2 = rects[i]
+
+         placement = {
+            'rect': rects[i],
+            # only cameras under another camera need to be added, rather than copied
+            'add': any(overlaps(rects[i], other) for other in rects[:i]),
+            'blend': None
+         }
+
+         blend = get_placement(cam_props)['blend']
+         if blend is not None:
+            blend_start, blend_end, blend_step = blend
+            mask_size = (blend_end - blend_start)
+            mask = np.arange(mask_size)/float(mask_size)
+
+            if blend_step < 0:
+               mask = mask[::-1]
+
+            # weighted value of every intensity, for each column of the ramp
+            lut = (np.arange(256)[np.newaxis, :] * mask[:, np.newaxis]).astype(np.uint8)
+
+            index_type = np.uint16 if (mask_size * 256) <= 65536 else np.uint32
+            index_shape = (1, mask_size) + (1,) * (len(shape) - 2)
+            ramp_shape = (y2 - y1, mask_size) + shape[2:]
+
+            placement['blend'] = {
+               'start': blend_start,
+               'end': blend_end,
+               'lut': lut.ravel(),
+               'columns': (np.arange(mask_size) * 256).astype(index_type).reshape(index_shape),
+               'index': np.zeros(ramp_shape, dtype=index_type),
+               'weighted': np.zeros(ramp_shape, dtype=np.uint8)
+            }
+
+         self.placements.append(placement)
+
+   def _place(self, dst, src, add):
+      if src.shape[1] == 0:
+         return
+      if add:
+         cv2.add(dst, src, dst=dst)
+      else:
+         np.copyto(dst, src)
+
+   def composite(self, frames):
+      self.buffer_index = 1 - self.buffer_index
+      frame = self.buffers[self.buffer_index]
+
+      if self.clear:
+         frame.fill(0)
+
+      for placement, cam_frame in zip(self.placements, frames):
+         x1, y1, x2, y2 = placement['rect']
+         dst = frame[y1:y2, x1:x2]
+
+         if cam_frame is None:
+            if not self.clear:
+               dst.fill(0)
+            continue
+
+         add = placement['add']
+         blend = placement['blend']
+
+         if blend is None:
+            self._place(dst, cam_frame, add)
+            continue
+
+         blend_start = blend['start']
+         blend_end = blend['end']
+
+         # weight the ramp columns through the lookup table
+         np.add(cam_frame[:, blend_start:blend_end], blend['columns'], out=blend['index'])
+         np.take(blend['lut'], blend['index'], out=blend['weighted'])
+
+         self._place(dst[:, :blend_start], cam_frame[:, :blend_start], add)
+         self._place(dst[:, blend_start:blend_end], blend['weighted'], add)
+         self._place(dst[:, blend_end:], cam_frame[:, blend_end:], add)
+
+      return frame
+
+# gamma lookup tables, cached by (phi, theta)
+GAMMA_LUTS = {}
+
+def gamma_lut(phi=1, theta=1):
+   key = (phi, theta)
+
+   if key not in GAMMA_LUTS:
+      # Parameters for manipulating image data
+      maxIntensity = 255.0 # depends on dtype of image data
+
+      # Increase intensity such that
+      # dark pixels become much brighter, 
+      # bright pixels become slightly bright
+      intensities = np.arange(256)
+      lut = (maxIntensity/phi)*(intensities/(maxIntensity/theta))**0.5
+      GAMMA_LUTS[key] = np.array(np.clip(lut, 0, maxIntensity), dtype=np.uint8)
+
+   return GAMMA_LUTS[key]
+
+def greyscale(img, phi=1, theta=1):
+   if img.ndim == 2:
+      # already grey, e.g. from a grey raw recording
+      grey_img = img
+   else:
+      grey_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
    #grey_img = cv2.equalizeHist(grey_img)
-   # Parameters for manipulating image data
-   maxIntensity = 255.0 # depends on dtype of image data
-   phi = 1
-   theta = 1
-
-   # Increase intensity such that
-   # dark pixels become much brighter, 
-   # bright pixels become slightly bright
-   grey_img = (maxIntensity/phi)*(grey_img/(maxIntensity/theta))**0.5
-   grey_img = np.array(grey_img, dtype=np.uint8)
-   return grey_img
-
-def set_up_cameras(camera_config):   
-   min_x = 0
-   max_x = 0
-   min_y = 0
-   max_y = 0
+   return cv2.LUT(grey_img, gamma_lut(phi, theta))
+
+def get_placement(cam_props):
+   # where a camera's frames sit in the composite, once cropped and scaled.
+   # offset is where the camera's (uncropped) frame starts in the composite, so
+   # cameras of different scales stay where they're put; crop and blend are
+   # configured in the camera's own pixels.
+   x, y = cam_props['offset']
+   w, h = cam_props['resolution']
+   scale = cam_props.get('scale', 1.0)
+
+   crop = cam_props.get('crop')
+   if crop is None:
+      crop = (0, 0, w, h)
+   x1, y1, x2, y2 = [int(val) for val in crop]
+
+   blend = cam_props.get('blend')
+   if blend is not None:
+      # [start, end] or [start, end, step], where a negative step ramps down
+      if len(blend) == 2:
+         blend_start, blend_end = blend
+         blend_step = 1
+      elif len(blend) == 3:
+         blend_start, blend_end, blend_step = blend
+      else:
+         raise ValueError('Camera %s: blend should be [start, end] or [start, end, step], got %s' % (cam_props.get('source'), blend))
+
+      # move the blend ramp into the cropped region
+      blend_start = int(round(min(max(blend_start - x1, 0), x2 - x1) * scale))
+      blend_end = int(round(min(max(blend_end - x1, 0), x2 - x1) * scale))
+
+      if blend_end > blend_start:
+         blend = (blend_start, blend_end, blend_step)
+      else:
+         blend = None
+
+   return {
+      'crop': (x1, y1, x2, y2),
+      'scale': scale,
+      'offset': (int(round(x + x1 * scale)), int(round(y + y1 * scale))),
+      'size': (int(round((x2 - x1) * scale)), int(round((y2 - y1) * scale))),
+      'blend': blend
+   }
+
+def prepare_frame(cam_props, frame):
+   # per-camera processing, applied as each frame is captured
+   placed = cam_props['placement']
+
+   w, h = cam_props['resolution']
+   if frame.shape[:2] != (h, w):
+      # cameras may not honour the requested resolution, and files can't be asked for
+      # one, so frames are conformed to the camera config that crops and placement use
+      frame = cv2.resize(frame, (w, h))
+
+   if cam_props.get('crop') is not None:
+      x1, y1, x2, y2 = placed['crop']
+      frame = frame[y1:y2, x1:x2]
+
+   if cam_props.get('grey', False):
+      frame = greyscale(frame)
+   elif frame.ndim == 2:
+      frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+
+   if placed['scale'] != 1.0:
+      frame = cv2.resize(frame, placed['size'], interpolation=cv2.INTER_AREA)
+
+   return frame
+
+def set_up_cameras(camera_config, capture_mode='direct', grey=False, juggle_interval=1, replay=None):
+   # the composite frame is bounded by the cameras' (cropped) placements
+   min_x = float('inf')
+   max_x = float('-inf')
+   min_y = float('inf')
+   max_y = float('-inf')
+
+   clock = None
+   if replay is not None:
+      # sources are recorded files, played back in lockstep
+      clock = ReplayClock(replay.get('mode', 'fast'), replay.get('fps', 25.0))
    
    for cam_props in camera_config:
-      x, y = cam_props['offset']
-      w, h = cam_props['resolution']
+      placed = get_placement(cam_props)
+      cam_props['placement'] = placed
+
+      x, y = placed['offset']
+      w, h = placed['size']
 
       min_x = min(x, min_x)
       max_x = max(x + w, max_x)
       min_y = min(y, min_y)
       max_y = max(y + h, max_y)
 
+      # the camera still captures at its full resolution
+      w, h = cam_props['resolution']
+
       props = {
          cv2.CAP_PROP_FRAME_WIDTH: w,
          cv2.CAP_PROP_FRAME_HEIGHT: h
       }
 
-      cam_src = init_cam(cam_props, props)
+      # in grey mode frames are converted at capture, and composited as single channel images
+      cam_props['grey'] = grey
+
+      if clock is not None:
+         cam_src = ReplayCapture(cam_props['source'], clock)
+      else:
+         cam_src = init_cam(cam_props, props, capture_mode)
       cam_props['capture'] = cam_src
 
 
    cams = sorted(camera_config, key=lambda x: x.get('z-index', 0))
 
+   dimensions = (
+      (max_x - min_x),
+      (max_y - min_y)
+   )
+
+   scales = [cam_props['placement']['scale'] for cam_props in cams]
+
+   # stagger the juggled cameras, so they are read in turn
+   juggled = [cam_props for cam_props in cams if cam_props.get('juggle', False)]
+   for i, cam_props in enumerate(juggled):
+      cam_props['juggle_phase'] = i % juggle_interval
+
    return {
       'cameras': cams,
-      'dimensions': (
-         (max_x - min_x),
-         (max_y - min_y)
-      ),
-      'offset': (min_x, min_y)
+      'dimensions': dimensions,
+      'offset': (min_x, min_y),
+      'scale_range': (min(scales), max(scales)),
+      'juggle_interval': juggle_interval,
+      'frame_index': 0,
+      'clock': clock,
+      'compositor': Compositor(cams, dimensions, (min_x, min_y), 1 if grey else 3)
    }
 
+def camera_rect(cam_setup, cam_props):
+   # the rect (x1, y1, x2, y2) a camera covers in the composite frame
+   min_x, min_y = cam_setup['offset']
+   placed = cam_props['placement']
+   cam_x, cam_y = placed['offset']
+   cam_w, cam_h = placed['size']
+   cam_x -= min_x
+   cam_y -= min_y
+   return (cam_x, cam_y, cam_x + cam_w, cam_y + cam_h)
+
+def camera_at(cam_setup, x, y):
+   # the topmost camera covering a point in the composite frame
+   for cam_props in reversed(cam_setup['cameras']):
+      x1, y1, x2, y2 = camera_rect(cam_setup, cam_props)
+
+      if x1 <= x < x2 and y1 <= y < y2:
+         return cam_props
+
+   return None
+
+def camera_scale_at(cam_setup, x, y):
+   # how many composite pixels there are per camera pixel at a point
+   cam_props = camera_at(cam_setup, x, y)
+   if cam_props is None:
+      return 1.0
+   return cam_props['placement']['scale']
+
 def release_cams(cam_setup):
-   for cam_props in cam_setup:
+   for cam_props in cam_setup['cameras']:
+      # drop the last frame read from the camera
+      cam_props['last_frame'] = None
+
       if 'capture' in cam_props:
          try:
             cam_props['capture'].release()
          except Exception:
             pass
 
-def init_cam(cam_props, cv_props):
-   cam_src = cv2.VideoCapture(cam_props['source'])
+def init_cam(cam_props, cv_props, capture_mode='direct'):
+   if capture_mode == 'process':
+      # the camera is opened by the capture process
+      return ProcessCapture(cam_props, cv_props)
+
+   cam_src = open_source(cam_props['source'])
    for prop in cv_props:
       cam_src.set(prop, cv_props[prop])
+
+   if capture_mode == 'threaded':
+      cam_src = ThreadedCapture(
+         cam_src, cam_props.get('buffer_size', 2), lambda frame: prepare_frame(cam_props, frame),
+         juggled=cam_props.get('juggle', False)
+      )
+   elif capture_mode != 'direct':
+      raise ValueError('Unknown capture mode: %s' % capture_mode)
+
    return cam_src
 
-def get_blended_frame(cam_setup):
+def read_camera(cam_props):
+   # returns (is_captured, frame, timestamp) for the camera's newest frame
+   capture = cam_props['capture']
+
+   if hasattr(capture, 'latest'):
+      # threaded and process captures have already prepared their frames
+      latest = capture.latest()
+      if latest is None:
+         return False, None, None
+      index, timestamp, frame = latest
+      return True, frame, timestamp
+
+   is_captured, frame = capture.read()
+   timestamp = time.time()
+
+   if isinstance(capture, ReplayCapture):
+      timestamp = capture.timestamp
+
+   if is_captured:
+      frame = prepare_frame(cam_props, frame)
+
+   return is_captured, frame, timestamp
+
+def get_capture_stats(cam_setup):
+   stats = []
+   for cam_props in cam_setup['cameras']:
+      capture = cam_props['capture']
+      if hasattr(capture, 'frames_dropped'):
+         stats.append({
+            'source': cam_props['source'],
+            'captured': capture.frames_captured,
+            'dropped': capture.frames_dropped,
+            'timestamp': cam_props.get('timestamp')
+         })
+      else:
+         stats.append({
+            'source': cam_props['source'],
+            'timestamp': cam_props.get('timestamp')
+         })
+   return stats
+
+def read_frames(cam_setup):
+   # reads the newest frame from each camera (in z-order), None for a failed read.
+   # juggled cameras are only read every juggle_interval frames, in turn,
+   # and their last frame is reused in between
+   frames = []
+   fresh = []
+   timestamps = []
+
+   interval = cam_setup.get('juggle_interval', 1)
+   frame_index = cam_setup.get('frame_index', 0)
+
+   if cam_setup.get('clock') is not None:
+      cam_setup['clock'].tick()
+
+   for cam_props in cam_setup['cameras']:
+      last_frame = cam_props.get('last_frame')
+
+      if cam_props.get('juggle', False) and last_frame is not None:
+         if (frame_index - cam_props['juggle_phase']) % interval != 0:
+            frames.append(last_frame)
+            fresh.append(False)
+            continue
+
+      is_captured, cam_frame, timestamp = read_camera(cam_props)
+
+      if is_captured:
+         cam_props['timestamp'] = timestamp
+         timestamps.append(timestamp)
+      else:
+         cam_frame = None
+
+      cam_props['last_frame'] = cam_frame
+
+      frames.append(cam_frame)
+      fresh.append(True)
+
+   for cam_props in cam_setup['cameras']:
+      # threaded captures of juggled cameras only decode the frame for their next turn
+      if cam_props.get('juggle', False) and hasattr(cam_props['capture'], 'request'):
+         if (frame_index + 1 - cam_props['juggle_phase']) % interval == 0:
+            cam_props['capture'].request()
+
+   cam_setup['fresh'] = fresh
+   cam_setup['frame_index'] = frame_index + 1
+
+   # capture time of the oldest frame read, for measuring latency
+   cam_setup['timestamp'] = min(timestamps) if len(timestamps) > 0 else None
+
+   return frames
+
+def sources_finished(cam_setup):
+   # whether a replayed source has run out of frames
+   return any(
+      isinstance(cam_props.get('capture'), ReplayCapture) and cam_props['capture'].finished
+      for cam_props in cam_setup['cameras']
+   )
+
+def get_regions(cam_setup, fresh=True):
+   # composite rects (x1, y1, x2, y2) of the cameras that were (or weren't) refreshed
+   # by the last read_frames, so later stages can skip stale parts of the frame
+   regions = []
+
+   for cam_props, is_fresh in zip(cam_setup['cameras'], cam_setup.get('fresh', [])):
+      if is_fresh == fresh:
+         regions.append(camera_rect(cam_setup, cam_props))
+
+   return regions
+
+def blend_frames(cam_setup, frames):
+   # reference (float) implementation of Compositor.composite
    cameras = cam_setup['cameras']
    w, h = cam_setup['dimensions']
    min_x, min_y = cam_setup['offset']
 
    frame = np.zeros((h, w, 3))
 
-   for cam_props in cameras:
-      cam_x, cam_y = cam_props['offset']
-      cam_w, cam_h = cam_props['resolution']
+   for cam_props, cam_frame in zip(cameras, frames):
+      placed = get_placement(cam_props)
+      cam_x, cam_y = placed['offset']
+      cam_w, cam_h = placed['size']
 
       cam_x -= min_x
       cam_y -= min_y
 
-      is_captured, cam_frame = cam_props['capture'].read()
+      if cam_frame is not None:
 
-      if is_captured:
-
-         if 'blend' in cam_props and cam_props['blend'] is not None:
-            blend_start, blend_end, blend_step = cam_props['blend']
+         if placed['blend'] is not None:
+            blend_start, blend_end, blend_step = placed['blend']
             mask_size = (blend_end - blend_start)
             mask = np.arange(mask_size)/float(mask_size)
 
@@ -126,12 +855,19 @@ def get_blended_frame(cam_setup):
 
             mask = np.array([[x,x,x] for x in mask])
 
-            cam_frame[:, blend_start:blend_end, :] *= mask
+            # the captured frame may still be held by a capture thread, so blend a copy
+            cam_frame = cam_frame.copy()
+            cam_frame[:, blend_start:blend_end, :] = cam_frame[:, blend_start:blend_end, :] * mask
 
 
          frame[cam_y:(cam_y+cam_h), cam_x:(cam_x+cam_w)] += cam_frame
 
-   return np.array(frame, dtype='uint8')
+   # overlaps brighter than white are clipped, rather than wrapping around
+   return np.array(np.clip(frame, 0, 255), dtype='uint8')
+
+def get_blended_frame(cam_setup):
+   frames = read_frames(cam_setup)
+   return cam_setup['compositor'].composite(frames)
 
 def get_frames(quit_key='q', source=0, props=DEFAULT_CAP_PROPS, crop=None):
    video_capture = cv2.VideoCapture(source)
@@ -1,5 +1,17 @@
+import numpy as np
+
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from scipy.spatial import cKDTree as KDTree
 
+# the cost of pairs that are too far apart to be the same feature
+GATED_COST = 1e9
+
+# above this many old x new pairs, only nearby pairs are considered, and each
+# group of features that could be paired up is solved on its own
+SPARSE_PAIRS = 2500
+
 ID = 0
 def new_data(feature):
    global ID
@@ -14,7 +26,13 @@ def new_data(feature):
 #    features: features that carried over from old to new
 #    feature_data: the respective data for those features (from old_data)
 #    missing_features: features that were in new_features and not in old_features
-def correspond(old_data, old_features, new_features, threshold=100, d=2):
+def correspond(old_data, old_features, new_features, threshold=100, d=2, method='greedy', size_weight=0.5, max_size_ratio=2.0, predict=True):
+   # method 'greedy' pairs each old feature with its nearest new one, in turn.
+   # 'optimal' finds the pairing with the least total cost, see assign()
+   if method == 'optimal':
+      nearest_neighbours, missing_feature_indexes = assign(old_data, old_features, new_features, threshold, d, size_weight, max_size_ratio, predict)
+      return collate(old_data, new_features, nearest_neighbours, missing_feature_indexes)
+
    # trim to dimensional coordinates
    old_features_d = [feature[:d] for feature in old_features]
    new_features_d = [feature[:d] for feature in new_features]
@@ -61,6 +79,105 @@ def correspond(old_data, old_features, new_features, threshold=100, d=2):
          # there is no nearby new feature, this old feature has gone missing
          missing_feature_indexes.add(old_i)
 
+   return collate(old_data, new_features, nearest_neighbours, missing_feature_indexes)
+
+def pair_costs(old_positions, old_sizes, new_positions, new_sizes, old_i, new_i, threshold, size_weight, max_size_ratio):
+   # the cost of pairing each old_i with each new_i: how far the new feature is from
+   # where the old one was predicted to be, plus how much its size changed.
+   # pairs too far apart, or too different in size, are gated
+   offsets = new_positions[new_i] - old_positions[old_i]
+   distances = np.sqrt((offsets ** 2).sum(axis=-1))
+
+   size_changes = np.abs(new_sizes[new_i] - old_sizes[old_i])
+   ratios = np.maximum(new_sizes[new_i], old_sizes[old_i]) / np.maximum(1e-6, np.minimum(new_sizes[new_i], old_sizes[old_i]))
+
+   costs = distances + size_weight * size_changes
+   costs[(distances >= threshold) | (ratios > max_size_ratio)] = GATED_COST
+   return costs
+
+def solve(costs):
+   # the (rows, cols) of the least cost assignment, without gated pairs
+   rows, cols = linear_sum_assignment(costs)
+   is_paired = costs[rows, cols] < GATED_COST
+   return rows[is_paired], cols[is_paired]
+
+def assign(old_data, old_features, new_features, threshold=100, d=2, size_weight=0.5, max_size_ratio=2.0, predict=True):
+   # pairs old features with new ones, for the least total cost (see pair_costs) over
+   # all the pairs, rather than nearest first. with predict, old features are expected
+   # to have moved on by their velocity, 'v' in their data, if they have one.
+   # returns the same nearest_neighbours and missing_feature_indexes as correspond()
+   num_old = len(old_features)
+   num_new = len(new_features)
+
+   if num_old == 0 or num_new == 0:
+      return {}, set(range(num_old))
+
+   old_features = np.asarray(old_features, dtype=np.float64)
+   new_features = np.asarray(new_features, dtype=np.float64)
+
+   old_positions = old_features[:, :d].copy()
+   if predict:
+      old_positions[:, :2] += np.array([data.get('v', (0, 0)) for data in old_data], dtype=np.float64).reshape(-1, 2)
+   new_positions = new_features[:, :d]
+
+   # features without a size are all the same size
+   old_sizes = old_features[:, 2] if old_features.shape[1] > 2 else np.ones(num_old)
+   new_sizes = new_features[:, 2] if new_features.shape[1] > 2 else np.ones(num_new)
+
+   args = (old_positions, old_sizes, new_positions, new_sizes)
+
+   if num_old * num_new <= SPARSE_PAIRS:
+      costs = pair_costs(*args, np.arange(num_old)[:, None], np.arange(num_new)[None, :], threshold, size_weight, max_size_ratio)
+      old_i, new_i = solve(costs)
+   else:
+      # only pairs within threshold of each other can be paired, and they fall into
+      # separate groups, which are each solved on their own
+      pairs = KDTree(old_positions).sparse_distance_matrix(KDTree(new_positions), threshold, output_type='ndarray')
+      graph = coo_matrix((np.ones(len(pairs)), (pairs['i'], pairs['j'] + num_old)), shape=(num_old + num_new, num_old + num_new))
+      num_groups, groups = connected_components(graph, directed=False)
+
+      old_groups = groups[:num_old]
+      new_groups = groups[num_old:]
+      old_counts = np.bincount(old_groups, minlength=num_groups)
+      new_counts = np.bincount(new_groups, minlength=num_groups)
+
+      # most groups are a lone pair, which only need checking against the gate
+      pair_old = pairs['i'].astype(int)
+      pair_new = pairs['j'].astype(int)
+      pair_groups = old_groups[pair_old]
+      is_lone = (old_counts[pair_groups] == 1) & (new_counts[pair_groups] == 1)
+      lone_costs = pair_costs(*args, pair_old[is_lone], pair_new[is_lone], threshold, size_weight, max_size_ratio)
+      is_paired = lone_costs < GATED_COST
+
+      old_i = list(pair_old[is_lone][is_paired])
+      new_i = list(pair_new[is_lone][is_paired])
+
+      old_order = np.argsort(old_groups, kind='stable')
+      new_order = np.argsort(new_groups, kind='stable')
+      old_bounds = np.searchsorted(old_groups[old_order], np.arange(num_groups + 1))
+      new_bounds = np.searchsorted(new_groups[new_order], np.arange(num_groups + 1))
+
+      for group in np.flatnonzero((old_counts > 0) & (new_counts > 0) & ((old_counts > 1) | (new_counts > 1))):
+         group_old = old_order[old_bounds[group]:old_bounds[group + 1]]
+         group_new = new_order[new_bounds[group]:new_bounds[group + 1]]
+         costs = pair_costs(*args, group_old[:, None], group_new[None, :], threshold, size_weight, max_size_ratio)
+         rows, cols = solve(costs)
+         old_i.extend(group_old[rows])
+         new_i.extend(group_new[cols])
+
+   # as before, the distance kept is from where the old feature was
+   old_i = np.asarray(old_i, dtype=int)
+   new_i = np.asarray(new_i, dtype=int)
+   distances = np.sqrt(((new_features[new_i, :d] - old_features[old_i, :d]) ** 2).sum(axis=-1))
+
+   nearest_neighbours = dict(zip(new_i.tolist(), zip(old_i.tolist(), distances.tolist())))
+
+   missing_feature_indexes = set(range(num_old)) - set(old_i.tolist())
+
+   return nearest_neighbours, missing_feature_indexes
+
+def collate(old_data, new_features, nearest_neighbours, missing_feature_indexes):
+   # the new features, with the data of the old features they're paired with
    # the new feature data
    feature_data = []
    features = []
@@ -91,7 +208,7 @@ def correspond(old_data, old_features, new_features, threshold=100, d=2):
 
    # data for features that have gone missing
    missing_features = []
-   for missing_i in missing_feature_indexes:
+   for missing_i in sorted(missing_feature_indexes):
       missing_data_point = {}
       missing_data_point.update(old_data[missing_i])
       missing_features.append(missing_data_point)
@@ -1,41 +1,650 @@
 import cv2, numpy as np
+import os
+import time
+import threading
+import image_stats
+from concurrent.futures import ThreadPoolExecutor
 
-FACE_CASCADE = cv2.CascadeClassifier('face_frontal.xml')
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-def detect_cascade(img, cascade, scale_factor, max_size, min_size):
-   flags = cv2.CASCADE_SCALE_IMAGE | cv2.CASCADE_DO_CANNY_PRUNING
+DEFAULT_FLAGS = cv2.CASCADE_SCALE_IMAGE | cv2.CASCADE_DO_CANNY_PRUNING
 
-   rects = cascade.detectMultiScale(img, scaleFactor=scale_factor, minNeighbors=4, flags=flags, minSize=min_size, maxSize=max_size)
+# the detector backend faces are found with, see set_detector()
+DETECTOR = None
+
+# shared pool for detecting over several regions at once
+DETECTION_POOL = None
+
+def resolve_path(path):
+   # model files are found relative to this module, wherever it's run from
+   if os.path.isabs(path):
+      return path
+   return os.path.join(MODULE_DIR, path)
+
+def cascade_dirs():
+   # where OpenCV installs its cascades, when it does (pip builds only ship the Haar ones)
+   haar_dir = getattr(getattr(cv2, 'data', None), 'haarcascades', None)
+   if haar_dir is None:
+      return []
+   return [haar_dir, os.path.join(os.path.dirname(os.path.normpath(haar_dir)), 'lbpcascades')]
+
+def find_cascade(path):
+   # cascades are found relative to this module, or else among OpenCV's own
+   resolved = resolve_path(path)
+   if os.path.exists(resolved) or os.path.isabs(path):
+      return resolved
+
+   for cascade_dir in cascade_dirs():
+      candidate = os.path.join(cascade_dir, path)
+      if os.path.exists(candidate):
+         return candidate
+
+   return resolved
+
+def cascade_flags(flags):
+   # flags can be given by name, e.g. ["CASCADE_SCALE_IMAGE", "CASCADE_DO_CANNY_PRUNING"]
+   if isinstance(flags, (list, tuple)):
+      value = 0
+      for name in flags:
+         value |= getattr(cv2, name)
+      return value
+   return flags
+
+def get_pool(workers=None):
+   global DETECTION_POOL
+   if DETECTION_POOL is None:
+      DETECTION_POOL = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+   return DETECTION_POOL
+
+def detect_cascade(img, cascade, scale_factor, max_size, min_size, min_neighbors=4, flags=DEFAULT_FLAGS):
+   rects = cascade.detectMultiScale(img, scaleFactor=scale_factor, minNeighbors=min_neighbors, flags=flags, minSize=min_size, maxSize=max_size)
    if len(rects) == 0:
       return []
    rects[:,2:] += rects[:,:2]
    return rects
 
-def is_bright_enough(min_brightness, frame, rect):
-   x1, y1, x2, y2 = rect
+class CascadeDetector(object):
+   """ Finds faces with a cascade classifier file, Haar (the default) or LBP
+
+   Cascades aren't safe to share between threads, so each thread loads its own.
+   """
+   def __init__(self, path='face_frontal.xml', min_neighbors=4, flags=DEFAULT_FLAGS):
+      self.path = find_cascade(path)
+      self.min_neighbors = min_neighbors
+      self.flags = cascade_flags(flags)
+
+      if not os.path.exists(self.path):
+         raise IOError(
+            'Cascade not found: %s (looked next to face_detector.py and in %s). '
+            'OpenCV\'s cascades come with its source under data/haarcascades and data/lbpcascades; '
+            'copy one into src/ or give the detector its path'
+            % (path, ', '.join(cascade_dirs()) or 'no OpenCV cascade directory')
+         )
+
+      self.local = threading.local()
+      self.window_size = self.cascade().getOriginalWindowSize()
+
+   def cascade(self):
+      if not hasattr(self.local, 'cascade'):
+         self.local.cascade = cv2.CascadeClassifier(self.path)
+      return self.local.cascade
+
+   def detect(self, img, scale_factor, max_size, min_size):
+      return detect_cascade(img, self.cascade(), scale_factor, max_size, min_size, self.min_neighbors, self.flags)
+
+class DnnDetector(object):
+   """ Finds faces with an OpenCV DNN model that outputs SSD style detections
+
+   (like OpenCV's res10_300x300_ssd Caffe model). The network sees the whole
+   image at input_size, so the scale factor is ignored, and faces outside the
+   size range are dropped. Each thread loads its own network.
+   """
+   def __init__(self, model, config=None, input_size=(300, 300), confidence=0.5, mean=(104.0, 177.0, 123.0), scale=1.0, swap_rb=False):
+      self.model = resolve_path(model)
+      self.config = resolve_path(config) if config is not None else None
+      self.input_size = tuple(input_size)
+      self.confidence = confidence
+      self.mean = tuple(mean)
+      self.scale = scale
+      self.swap_rb = swap_rb
+
+      if not os.path.exists(self.model):
+         raise IOError('Model not found: %s' % self.model)
+
+      self.local = threading.local()
+      self.window_size = None
+
+   def net(self):
+      if not hasattr(self.local, 'net'):
+         if self.config is None:
+            self.local.net = cv2.dnn.readNet(self.model)
+         else:
+            self.local.net = cv2.dnn.readNet(self.model, self.config)
+      return self.local.net
+
+   def detect(self, img, scale_factor, max_size, min_size):
+      h, w = img.shape[:2]
+      if len(img.shape) == 2:
+         img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+      net = self.net()
+      net.setInput(cv2.dnn.blobFromImage(img, self.scale, self.input_size, self.mean, self.swap_rb, False))
+      detections = net.forward().reshape(-1, 7)
+
+      # each detection is (batch, class, confidence, x1, y1, x2, y2), in 0-1 image units
+      detections = detections[detections[:, 2] > self.confidence]
+      rects = np.round(detections[:, 3:7] * [w, h, w, h]).astype(int)
+      rects[:, 0::2] = np.clip(rects[:, 0::2], 0, w)
+      rects[:, 1::2] = np.clip(rects[:, 1::2], 0, h)
+
+      heights = rects[:, 3] - rects[:, 1]
+      in_range = (heights >= min_size[1]) & (heights <= max_size[1])
+      return list(rects[in_range])
+
+DETECTOR_TYPES = {
+   'haar': CascadeDetector,
+   'lbp': CascadeDetector,
+   'dnn': DnnDetector
+}
+
+DEFAULT_DETECTOR_ARGS = {
+   'haar': {'path': 'face_frontal.xml'},
+   'lbp': {'path': 'lbpcascade_frontalface.xml'}
+}
+
+def create_detector(detector_config=None):
+   # a detector from its config, {"backend": "haar" | "lbp" | "dnn", ...its arguments}
+   detector_config = dict(detector_config or {})
+   backend = detector_config.pop('backend', 'haar')
+
+   if backend not in DETECTOR_TYPES:
+      raise ValueError('Unknown detector backend: %s' % backend)
+
+   args = dict(DEFAULT_DETECTOR_ARGS.get(backend, {}))
+   args.update(detector_config)
+   return DETECTOR_TYPES[backend](**args)
+
+def set_detector(detector):
+   global DETECTOR
+   DETECTOR = detector
+
+def get_detector():
+   if DETECTOR is None:
+      set_detector(create_detector())
+   return DETECTOR
+
+def suppress_overlaps(rects, threshold=0.3):
+   # non-maximum suppression: keeps the larger of any rects (x1, y1, x2, y2)
+   # that overlap by more than threshold (intersection over union)
+   if len(rects) < 2:
+      return list(rects)
+
+   rects = np.array(rects)
+   x1, y1, x2, y2 = rects.T
+   areas = (x2 - x1) * (y2 - y1)
+
+   order = np.argsort(areas)[::-1]
+   kept = []
+
+   while len(order) > 0:
+      i = order[0]
+      kept.append(rects[i])
+
+      others = order[1:]
+      inter_w = np.maximum(0, np.minimum(x2[i], x2[others]) - np.maximum(x1[i], x1[others]))
+      inter_h = np.maximum(0, np.minimum(y2[i], y2[others]) - np.maximum(y1[i], y1[others]))
+      intersection = inter_w * inter_h
+      overlap = intersection / (areas[i] + areas[others] - intersection).astype(float)
+
+      order = others[overlap <= threshold]
+
+   return kept
+
+def detect_region(img, region, scale_factor, max_size, min_size):
+   # runs the detector over a region, returning rects in image coordinates
+   x1, y1, x2, y2 = region
+   region_rects = get_detector().detect(img[y1:y2, x1:x2], scale_factor, max_size, min_size)
+   return [(rx1 + x1, ry1 + y1, rx2 + x1, ry2 + y1) for rx1, ry1, rx2, ry2 in region_rects]
+
+def detect_regions(img, regions, scale_factor, max_size, min_size, pool=None):
+   # runs the cascade over each region (x1, y1, x2, y2) of the image,
+   # returning rects in image coordinates. with a pool, regions are searched in parallel
+   h, w = img.shape[:2]
+
+   clipped = []
+   for x1, y1, x2, y2 in regions:
+      x1, y1 = max(0, int(x1)), max(0, int(y1))
+      x2, y2 = min(w, int(x2)), min(h, int(y2))
+
+      if x2 > x1 and y2 > y1:
+         clipped.append((x1, y1, x2, y2))
+
+   if pool is None or len(clipped) < 2:
+      region_rects = [detect_region(img, region, scale_factor, max_size, min_size) for region in clipped]
+   else:
+      region_rects = pool.map(lambda region: detect_region(img, region, scale_factor, max_size, min_size), clipped)
+
+   rects = [rect for rects in region_rects for rect in rects]
+
+   # regions can overlap, so a face can be found more than once
+   return suppress_overlaps(rects)
+
+def split_regions(frame_w, frame_h, count, overlap):
+   # splits the frame into count strips along its longer axis,
+   # overlapping by overlap so anything up to that size is wholly inside a strip
+   length = max(frame_w, frame_h)
+   strip_length = int(np.ceil(length / float(count)))
+
+   regions = []
+   for i in range(count):
+      start = max(0, i * strip_length - overlap)
+      end = min(length, (i + 1) * strip_length + overlap)
+
+      if frame_w >= frame_h:
+         regions.append((start, 0, end, frame_h))
+      else:
+         regions.append((0, start, frame_w, end))
+
+   return regions
+
+def merge_regions(regions):
+   # merges overlapping regions (x1, y1, x2, y2) into their bounding rects
+   merged = [list(region) for region in regions]
+
+   is_merging = True
+   while is_merging:
+      is_merging = False
+      for i in range(len(merged)):
+         for j in range(i + 1, len(merged)):
+            a, b = merged[i], merged[j]
+            if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+               merged[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+               del merged[j]
+               is_merging = True
+               break
+         if is_merging:
+            break
+
+   return [tuple(region) for region in merged]
+
+def clip_regions(regions, limits):
+   # the parts of each region that fall inside any of the limiting regions
+   clipped = []
+
+   for x1, y1, x2, y2 in regions:
+      for lx1, ly1, lx2, ly2 in limits:
+         cx1, cy1 = max(x1, lx1), max(y1, ly1)
+         cx2, cy2 = min(x2, lx2), min(y2, ly2)
+         if cx2 > cx1 and cy2 > cy1:
+            clipped.append((cx1, cy1, cx2, cy2))
+
+   return clipped
+
+def face_window(face, padding, frame_w, frame_h):
+   # the region to search for a tracked face in the next frame
+   x, y, size = face['feature']
+   vx, vy = face.get('v', (0, 0))
+
+   # look where the face should be next, with room for it to have moved
+   x += vx
+   y += vy
+   half_w = size * (0.5 + padding) + abs(vx)
+   half_h = size * (0.5 + padding) + abs(vy)
+
+   return (
+      int(max(0, x - half_w)),
+      int(max(0, y - half_h)),
+      int(min(frame_w, x + half_w)),
+      int(min(frame_h, y + half_h))
+   )
+
+class DetectionScheduler(object):
+   """ Chooses which parts of the frame the cascade runs over
 
-   num_samples = 50
-   val = 0
-   for i in range(num_samples):
-      x = np.random.randint(x1, x2)
-      y = np.random.randint(y1, y2)
-      val += frame[y, x]
+   Most frames only search padded windows around tracked faces, moved ahead by
+   each face's velocity. Every sweep_interval frames a sweep looks for new
+   arrivals: over the whole frame, or (with bands > 1) over one of several
+   overlapping bands across the frame's longer axis, in turn.
+   """
+   def __init__(self, sweep_interval=5, bands=1, padding=1.0, max_size=200):
+      self.sweep_interval = max(1, sweep_interval)
+      self.bands = max(1, bands)
+      self.padding = padding
+      self.max_size = max_size
+      self.frame_count = 0
+      self.band_index = 0
 
-   av_brightness = (val/num_samples)
-   
-   return (av_brightness > min_brightness)
+   def _band(self, frame_w, frame_h):
+      # bands overlap by the largest face, so no face is only ever cut in two
+      band = split_regions(frame_w, frame_h, self.bands, self.max_size)[self.band_index]
+      self.band_index = (self.band_index + 1) % self.bands
+      return band
 
-def detect_faces(frame, scale_factor=1.2, max_size=(200, 200), min_size=(10, 10), min_brightness=35):
-   max_height = 25
+   def regions(self, frame_shape, tracked_faces):
+      # regions to search this frame, None for the whole frame
+      frame_h, frame_w = frame_shape[:2]
 
+      is_sweep = (self.frame_count % self.sweep_interval) == 0
+      self.frame_count += 1
+
+      if is_sweep and self.bands == 1:
+         return None
+
+      regions = [face_window(face, self.padding, frame_w, frame_h) for face in tracked_faces]
+
+      if is_sweep:
+         regions.append(self._band(frame_w, frame_h))
+
+      return merge_regions(regions)
+
+class SizeScheduler(object):
+   """ Chooses which face sizes the cascade searches for each frame
+
+   The size range is split into geometric bands. Bands where faces have been
+   tracked recently are searched most often, while every band is still searched
+   at least every explore_interval frames to notice new arrivals. With a budget
+   (ms per frame), neighbouring bands are only added while the estimated cost
+   of the search stays within it.
+   """
+   def __init__(self, max_size, min_size, scale_factor=1.2, bands=5, explore_interval=10, budget=None, decay=0.9, window_size=24):
+      self.max_size = max_size
+      self.min_size = min_size
+      self.scale_factor = scale_factor
+      self.bands = max(1, bands)
+      self.explore_interval = max(1, explore_interval)
+      self.budget = budget
+      self.decay = decay
+      self.window_size = window_size
+
+      # band i covers sizes from edges[i] down to edges[i + 1]
+      ratio = float(min_size) / max_size
+      self.edges = [max_size * ratio ** (i / float(self.bands)) for i in range(self.bands + 1)]
+
+      self.counts = [0.0] * self.bands
+      self.last_searched = [None] * self.bands
+      self.frame_count = 0
+
+      # cost of a search, in ms per unit of estimated cascade work (calibrated by record())
+      self.ms_per_unit = None
+      self.last_span = None
+
+   def band_of(self, size):
+      for i in range(self.bands):
+         if size >= self.edges[i + 1]:
+            return i
+      return self.bands - 1
+
+   def update(self, tracked_faces):
+      # faces tracked this frame, with detected faces counting for more than inferred ones
+      self.counts = [count * self.decay for count in self.counts]
+
+      for face in tracked_faces:
+         size = face['feature'][2]
+         weight = 1.0 if face.get('mode') == 'detected' else 0.5
+         self.counts[self.band_of(size)] += weight
+
+   def _span_range(self, first, last):
+      # a scale step of margin either side, so faces crossing an edge aren't lost
+      max_size = int(min(self.max_size, self.edges[first] * self.scale_factor))
+      min_size = int(max(self.min_size, self.edges[last + 1] / self.scale_factor))
+      return (max_size, max_size), (min_size, min_size)
+
+   def units(self, first, last):
+      # the cascade's work is roughly the pixels in each level of its image pyramid,
+      # which is the frame area scaled by (window / face size) squared
+      (max_size, _), (min_size, _) = self._span_range(first, last)
+      units = 0.0
+      size = max(min_size, self.window_size)
+      while size <= max_size:
+         units += (float(self.window_size) / size) ** 2
+         size *= self.scale_factor
+      return units
+
+   def cost(self, first, last):
+      if self.ms_per_unit is None:
+         return 0.0
+      return self.units(first, last) * self.ms_per_unit
+
+   def record(self, elapsed, span=None):
+      # calibrate the cost estimate from how long a search took (in ms), of the
+      # bands span, (first, last), or else of the last range handed out
+      if span is None:
+         span = self.last_span
+      if span is None:
+         return
+
+      units = self.units(*span)
+      if units <= 0:
+         return
+
+      ms_per_unit = elapsed / units
+      if self.ms_per_unit is None:
+         self.ms_per_unit = ms_per_unit
+      else:
+         self.ms_per_unit = 0.8 * self.ms_per_unit + 0.2 * ms_per_unit
+
+   def _is_overdue(self, band):
+      last_searched = self.last_searched[band]
+      return last_searched is None or self.frame_count - last_searched >= self.explore_interval
+
+   def next_range(self):
+      # (max_size, min_size) to search this frame
+      bands = range(self.bands)
+
+      overdue = [band for band in bands if self._is_overdue(band)]
+      if len(overdue) > 0:
+         # the band that has gone longest without a search goes first
+         first = last = min(overdue, key=lambda band: (self.last_searched[band] is not None, self.last_searched[band]))
+      else:
+         first = last = max(bands, key=lambda band: self.counts[band])
+
+      # widen the search to the other bands where faces are, busiest first,
+      # while it stays within budget
+      occupied = sorted((band for band in bands if self.counts[band] >= 0.5), key=lambda band: -self.counts[band])
+      for band in occupied:
+         new_first = min(first, band)
+         new_last = max(last, band)
+         if self.budget is not None and self.cost(new_first, new_last) > self.budget:
+            continue
+         first, last = new_first, new_last
+
+      for band in range(first, last + 1):
+         self.last_searched[band] = self.frame_count
+      self.frame_count += 1
+      self.last_span = (first, last)
+
+      return self._span_range(first, last)
+
+def filter_bright(face_rects, stats, min_brightness):
+   # keeps the rects with a mean brightness above min_brightness
+   if len(face_rects) == 0:
+      return []
+
+   is_bright = stats.means(face_rects) > min_brightness
+   return [rect for rect, bright in zip(face_rects, is_bright) if bright]
+
+def scale_level(pyramid, min_size):
+   # the smallest pyramid level the smallest faces are still twice the cascade's window in.
+   # below twice its window, the cascade steps 2 pixels at a time, and misses faces
+   window_size = get_detector().window_size
+   if window_size is None:
+      return 0
+
+   window_w, window_h = window_size
+   return pyramid.level_for(min(min_size), 2 * max(window_w, window_h))
+
+def detect_faces(frame, scale_factor=1.2, max_size=(200, 200), min_size=(10, 10), min_brightness=35, min_height=25, regions=None, tiles=1, pool=None, stats=None, pyramid=None):
    # Capture frame-by-frame
    frame_h, frame_w = frame.shape
 
+   if regions is None and tiles > 1:
+      # split wide frames into overlapping tiles, to be searched in parallel
+      regions = split_regions(frame_w, frame_h, tiles, max(max_size))
+      if pool is None:
+         pool = get_pool()
+
+   # with a pyramid.FramePyramid of the frame, the cascade searches a smaller level
+   # of it, rather than scaling the whole frame down itself
+   img = frame
+   factor = 1
+   if pyramid is not None:
+      level = scale_level(pyramid, min_size)
+      img = pyramid.level(level)
+      factor = 2 ** level
+
+      max_size = tuple(int(size / factor) for size in max_size)
+      min_size = tuple(int(size / factor) for size in min_size)
+      if regions is not None:
+         regions = [
+            (int(x1 / factor), int(y1 / factor), int(np.ceil(x2 / float(factor))), int(np.ceil(y2 / float(factor))))
+            for x1, y1, x2, y2 in regions
+         ]
+
    # detect frontal faces
-   face_rects = detect_cascade(frame, FACE_CASCADE, scale_factor=scale_factor, max_size=max_size, min_size=min_size)
-   face_rects = [rect for rect in face_rects if is_bright_enough(min_brightness, frame, rect)]
+   if regions is None:
+      face_rects = get_detector().detect(img, scale_factor, max_size, min_size)
+   else:
+      # only look for faces in these parts of the frame
+      face_rects = detect_regions(img, regions, scale_factor=scale_factor, max_size=max_size, min_size=min_size, pool=pool)
+
+   if factor > 1:
+      face_rects = [tuple(int(value) * factor for value in rect) for rect in face_rects]
+
+   if len(face_rects) > 0:
+      if stats is None:
+         stats = image_stats.ImageStats(frame)
+      face_rects = filter_bright(face_rects, stats, min_brightness)
+
    face_points = [[float((x1+x2)/2.),float((y1+y2)/2.),float((np.abs(y2-y1)))] for x1, y1, x2, y2 in face_rects]
 
-   face_points = [(x, y, h) for x, y, h in face_points if h > max_height]
+   face_points = [(x, y, h) for x, y, h in face_points if h > min_height]
 
    return face_points
+
+def merge_face_points(face_points, threshold=0.3):
+   # merges face points (x, y, size) that are the same face seen twice
+   rects = [(x - size/2., y - size/2., x + size/2., y + size/2.) for x, y, size in face_points]
+   return [(float((x1+x2)/2.), float((y1+y2)/2.), float(y2-y1)) for x1, y1, x2, y2 in suppress_overlaps(rects, threshold)]
+
+def detect_camera_faces(frames, rects, regions=None, pool=None, **kwargs):
+   # detects faces in each camera's own (grey) frame, in parallel, rather than in the composite.
+   # rects are where each camera sits in the composite, regions are in composite coordinates.
+   # returns face points in composite coordinates, merged where cameras overlap
+   kwargs['tiles'] = 1
+
+   jobs = []
+   for frame, rect in zip(frames, rects):
+      if frame is None:
+         continue
+
+      cam_x1, cam_y1, cam_x2, cam_y2 = rect
+      cam_regions = None
+      if regions is not None:
+         cam_regions = [
+            (x1 - cam_x1, y1 - cam_y1, x2 - cam_x1, y2 - cam_y1)
+            for x1, y1, x2, y2 in clip_regions(regions, [rect])
+         ]
+         if len(cam_regions) == 0:
+            continue
+
+      jobs.append((frame, cam_x1, cam_y1, cam_regions))
+
+   def detect(job):
+      frame, cam_x1, cam_y1, cam_regions = job
+      face_points = detect_faces(frame, regions=cam_regions, **kwargs)
+      return [(x + cam_x1, y + cam_y1, size) for x, y, size in face_points]
+
+   if pool is None or len(jobs) < 2:
+      camera_points = [detect(job) for job in jobs]
+   else:
+      camera_points = pool.map(detect, jobs)
+
+   return merge_face_points([point for points in camera_points for point in points])
+
+class AsyncDetector(object):
+   """ Runs a detector on a worker thread, on the newest frame whenever it's free
+
+   submit() hands over a frame, or list of camera frames, (tagged with its
+   frame index) without waiting, if the worker is idle, and is ignored otherwise.
+   poll() returns the (frame_index, face_points, elapsed) of a finished
+   detection, once, or None, where elapsed is how long it took in ms. If a
+   detection raised, poll() raises its exception instead.
+   """
+   def __init__(self, detect=None):
+      self.detect = detect or detect_faces
+      self.condition = threading.Condition()
+      self.pending = None
+      self.busy = False
+      self.result = None
+      self.error = None
+      self.running = True
+
+      self.thread = threading.Thread(target=self._run)
+      self.thread.daemon = True
+      self.thread.start()
+
+   def _run(self):
+      while True:
+         with self.condition:
+            while self.running and self.pending is None:
+               self.condition.wait()
+
+            if not self.running:
+               break
+
+            frame_index, frame, kwargs = self.pending
+            self.pending = None
+            self.busy = True
+
+         result = None
+         error = None
+         try:
+            detection_start = time.time()
+            face_points = self.detect(frame, **kwargs)
+            result = (frame_index, face_points, 1000.0 * (time.time() - detection_start))
+         except Exception as detection_error:
+            # handed to the caller by poll(), rather than ending the worker
+            error = detection_error
+         finally:
+            with self.condition:
+               self.result = result
+               self.error = error
+               self.busy = False
+
+   def is_idle(self):
+      with self.condition:
+         return not self.busy and self.pending is None
+
+   def submit(self, frame_index, frame, **kwargs):
+      # frames are only taken while the worker is idle, so a busy worker costs no copies.
+      # (only the caller submits, so an idle worker stays idle until it does)
+      if not self.is_idle():
+         return False
+
+      # the frame is copied, as the caller's buffers are reused
+      if isinstance(frame, list):
+         frame = [cam_frame.copy() if cam_frame is not None else None for cam_frame in frame]
+      else:
+         frame = frame.copy()
+
+      with self.condition:
+         self.pending = (frame_index, frame, kwargs)
+         self.condition.notify()
+      return True
+
+   def poll(self):
+      with self.condition:
+         result = self.result
+         error = self.error
+         self.result = None
+         self.error = None
+
+      if error is not None:
+         raise error
+      return result
+
+   def release(self):
+      with self.condition:
+         self.running = False
+         self.condition.notify()
+      self.thread.join(1.0)
@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+
+# Per-frame image statistics from integral images. Each frame pays for the
+# integral once, then the mean (or variance) of any rect costs four lookups,
+# and many rects are answered at once.
+
+def as_rect_array(rects):
+   # rects (x1, y1, x2, y2) as an (n, 4) int array
+   return np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+
+class ImageStats(object):
+   """ Sums over a grey frame, for the mean and variance of its rects """
+   def __init__(self, img):
+      self.img = img
+      self.height, self.width = img.shape[:2]
+      self.sums = cv2.integral(img, sdepth=cv2.CV_64F)
+      self.squares = None
+
+   def _clip(self, rects):
+      rects = as_rect_array(rects)
+      x1 = np.clip(rects[:, 0], 0, self.width)
+      y1 = np.clip(rects[:, 1], 0, self.height)
+      x2 = np.clip(rects[:, 2], x1, self.width)
+      y2 = np.clip(rects[:, 3], y1, self.height)
+      return x1, y1, x2, y2
+
+   def _totals(self, integral, x1, y1, x2, y2):
+      return integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+
+   def _areas(self, x1, y1, x2, y2):
+      # empty rects count as one pixel, so their statistics come out as 0
+      return np.maximum(1, (x2 - x1) * (y2 - y1)).astype(np.float64)
+
+   def means(self, rects):
+      # mean brightness of each rect
+      x1, y1, x2, y2 = self._clip(rects)
+      return self._totals(self.sums, x1, y1, x2, y2) / self._areas(x1, y1, x2, y2)
+
+   def variances(self, rects):
+      # variance of the brightness of each rect, the square sums are only built when needed
+      if self.squares is None:
+         self.sums, self.squares = cv2.integral2(self.img, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+
+      x1, y1, x2, y2 = self._clip(rects)
+      areas = self._areas(x1, y1, x2, y2)
+      means = self._totals(self.sums, x1, y1, x2, y2) / areas
+      return np.maximum(0, self._totals(self.squares, x1, y1, x2, y2) / areas - means ** 2)
+
+   def mean(self, rect):
+      return float(self.means([rect])[0])
+
+   def variance(self, rect):
+      return float(self.variances([rect])[0])
@@ -6,16 +6,23 @@ import transport
 import face_detector
 import action_detector
 import template_matching
+import image_stats
+import pyramid
+import motion
 import correspondence
 import sys
+from tracking.multi_tracker import MultiTracker
 
 import cv2
 import copy
+import numpy as np
 
 import json
 
+from collections import deque
 
-def pack_feature(feature, dimensions):
+
+def pack_feature(feature, dimensions, scale=1.0):
    x, y, size = feature['feature']
 
    w, h = dimensions
@@ -23,6 +30,9 @@ def pack_feature(feature, dimensions):
    x /= w
    y /= h
 
+   # report sizes in camera pixels, however the frame was scaled
+   size /= scale
+
    y = (1.0 - y)
 
    mode = 0
@@ -61,6 +71,25 @@ def filter_features(features, max_features=None):
 
    return filtered_features
 
+def predicted_features(tracker, face_data):
+   # where the filters of faces expect them to be, with their last size unless
+   # the filters follow size as depth
+   features = np.array([data['feature'] for data in face_data], dtype=np.float64).reshape(-1, 3)
+   features[:, :tracker.d] = tracker.expected([data['filter'] for data in face_data])
+   return [tuple(feature) for feature in features.tolist()]
+
+def observe_faces(tracker, face_data):
+   # correct the filters of faces with where they were seen, and start filters for new faces
+   observed = [data for data in face_data if data.get('filter') is not None]
+   tracker.correct([data['filter'] for data in observed], [data['feature'][:tracker.d] for data in observed])
+   for data in face_data:
+      data['coasted_for'] = 0
+
+   new_faces_data = [data for data in face_data if data.get('filter') is None]
+   new_filters = tracker.add_filters([data['feature'][:tracker.d] for data in new_faces_data])
+   for data, predictor in zip(new_faces_data, new_filters):
+      data['filter'] = predictor
+
 def main(config):
 
    MAX_MATCHES = config['max_matches']
@@ -70,11 +99,27 @@ def main(config):
    faces = []
    face_data = []
    last_frame = None
+   last_frame_stats = None
+   last_frame_pyramid = None
+
+   # the face detector backend, and its parameters
+   face_detector.set_detector(face_detector.create_detector(config.get('detector')))
+
+   grey_capture = config.get('grey_capture', False)
 
-   cameras = camera.set_up_cameras(config['cameras'])
+   cameras = camera.set_up_cameras(
+      config['cameras'],
+      config.get('capture_mode', 'direct'),
+      grey_capture,
+      config.get('juggle_interval', 1),
+      config.get('replay')
+   )
 
    focal_length = config['focal_length']
 
+   # cameras can be downscaled at capture, so pixel sizes are scaled to match
+   min_scale, max_scale = cameras['scale_range']
+
    if USE_SCALING_ALTERNATION:
       # generate which face sizes to look for in each frame
       face_size_ranges = []
@@ -89,143 +134,579 @@ def main(config):
       face_size_ranges = [[(200, 200), (20, 20)]]
       face_scale = 1.2
 
-   frame_index = 0
-
-   cam_args = {}
-
-   if show_debug:
-      debug_render.init()
-
-   while True:
-      key = cv2.waitKey(1) & 0xFF
-      if key == ord('q'):
-         # wait for quit key to be pressed
-         break
-
-      frame = camera.get_blended_frame(cameras)
-      grey_frame = camera.greyscale(frame)
+   # the scale factor and face sizes can be tuned per deployment (see testing/tune_detection.py)
+   detection = config.get('detection', {})
+   if 'max_size' in detection or 'min_size' in detection:
+      max_size = detection.get('max_size', face_size_ranges[0][0][0])
+      min_size = detection.get('min_size', face_size_ranges[-1][1][0])
+      face_size_ranges = [[(max_size, max_size), (min_size, min_size)]]
+   face_scale = detection.get('scale_factor', face_scale)
 
-      if show_debug:
-         debug_frame = copy.copy(grey_frame)
-         debug_frame = cv2.cvtColor(debug_frame, cv2.COLOR_GRAY2BGR)
+   face_size_ranges = [
+      [(int(max_w * max_scale), int(max_h * max_scale)), (int(min_w * min_scale), int(min_h * min_scale))]
+      for (max_w, max_h), (min_w, min_h) in face_size_ranges
+   ]
 
-      max_face_size, min_face_size = face_size_ranges[frame_index]
+   frame_index = 0
 
-      new_faces = face_detector.detect_faces(grey_frame, scale_factor=face_scale, max_size=max_face_size, min_size=min_face_size)
+   # optionally, learn which face sizes are present and spend the cascade on those,
+   # rather than cycling through face_size_ranges
+   size_scheduler = None
+   if config.get('size_schedule') is not None:
+      schedule = config['size_schedule']
+      size_scheduler = face_detector.SizeScheduler(
+         max(max_w for (max_w, max_h), min_size in face_size_ranges),
+         min(min_w for max_size, (min_w, min_h) in face_size_ranges),
+         scale_factor=face_scale,
+         bands=schedule.get('bands', 5),
+         explore_interval=schedule.get('explore_interval', 10),
+         budget=schedule.get('budget_ms')
+      )
 
-      frame_h, frame_w = grey_frame.shape[:2]
+   cam_args = {}
 
-      if len(new_faces) > 0:
-         # Calculate corresponding features in adjacent frames
-         corresponding_faces = correspondence.correspond(face_data, faces, new_faces)
-         missing_faces_data = corresponding_faces['missing_features']
-         faces = corresponding_faces['features']
-         face_data = corresponding_faces['feature_data']
+   # optionally, only search for faces around the ones being tracked, with periodic sweeps
+   detection_scheduler = None
+   if config.get('detection_schedule') is not None:
+      schedule = config['detection_schedule']
+      detection_scheduler = face_detector.DetectionScheduler(
+         sweep_interval=schedule.get('sweep_interval', 5),
+         bands=schedule.get('bands', 1),
+         padding=schedule.get('padding', 1.0),
+         max_size=max(max_w for (max_w, max_h), min_size in face_size_ranges)
+      )
+
+   # optionally, detect (and calculate flow) in each camera's own frame, so the
+   # composite frame is only built when it is needed
+   per_camera = config.get('per_camera_detection', False)
+   per_camera_flow = per_camera and config.get('per_camera_flow', False)
+   camera_rects = [camera.camera_rect(cameras, cam_props) for cam_props in cameras['cameras']]
+   last_camera_frames = None
+   last_camera_pyramids = None
+
+   # faces whose last position is too flat to template match are let go
+   template_min_deviation = config.get('template_min_deviation')
+
+   # optionally, template match coarse to fine from this pyramid level,
+   # and let the cascade search a pyramid level rather than the whole frame
+   template_coarse_level = config.get('template_coarse_level', 0)
+
+   # optionally, search for missing faces where their velocity says they'll be, in windows
+   # that grow the longer they go undetected, and match faces larger than max_template_size
+   # (e.g. 48) at a smaller size first
+   adaptive_search = config.get('adaptive_search', False)
+   max_template_size = config.get('max_template_size')
+
+   # optionally, match missing faces by how they looked when last detected, rather than where
+   # they were last inferred (which drifts onto the background), and let weak matches end their tracks
+   cache_templates = config.get('cache_templates', False)
+   max_match_difference = config.get('max_match_difference')
+
+   # how detections are paired with tracked faces, 'greedy' (nearest first) or 'optimal'
+   correspondence_method = config.get('correspondence', 'greedy')
+
+   # the tracker engine, 'correspondence' follows faces between detections by template
+   # matching every missing face. 'multi_tracker' (experimental) follows each face with a
+   # filter of a tracking.MultiTracker (d=3 follows size as depth) and pairs detections with
+   # where the filters expect faces. Given an uncertainty_threshold, it also moves missing
+   # faces the filters are sure of on to where they're expected instead of template matching
+   # them, for at most max_coasted_frames in a row. Coasting is off unless configured, as
+   # filters fed by sparse detections guess worse than template matching on the test clips
+   tracker = config.get('tracker', {})
+   multi_tracker = None
+   if tracker.get('engine', 'correspondence') == 'multi_tracker':
+      multi_tracker = MultiTracker(
+         d=tracker.get('d', 2),
+         useKalman=tracker.get('kalman', True),
+         process_noise=tracker.get('process_noise', 1.0),
+         measurement_noise=tracker.get('measurement_noise', 4.0)
+      )
+      uncertainty_threshold = tracker.get('uncertainty_threshold')
+      max_coasted_frames = tracker.get('max_coasted_frames', 1)
+   pyramid_detection = config.get('pyramid_detection', False)
+
+   frame_w, frame_h = cameras['dimensions']
+   # stands in for the composite where only its shape is used
+   blank_frame = np.zeros((frame_h, frame_w), dtype=np.uint8)
+
+   # optionally, detect faces on a worker thread while tracking carries on at camera rate
+   async_detector = None
+   if config.get('async_detection', False):
+      if per_camera:
+         async_detector = face_detector.AsyncDetector(face_detector.detect_camera_faces)
       else:
-         missing_faces_data = face_data
-         faces = []
-         face_data = []
-
-      # Reset properties for detected faces
-      for face_data_point in face_data:
-         curr_x, curr_y, curr_s = face_data_point['feature']
-
-         if not face_data_point.get('has_moved', False):
-            has_moved = False
-            if 'last_detected_as' in face_data_point:
-               last_x, last_y, last_s = face_data_point['last_detected_as']
-               if ((last_x - curr_x)**2 + (last_y - curr_y)**2) > 10:
-                  has_moved = True
-
-            # see if this face has ever moved
-            is_moving = False
-            if 'v' in face_data_point:
-               vx, vy = face_data_point['v']
-               if (vx ** 2 + vy ** 2) > 3:
-                  is_moving = True
-
-            face_data_point['has_moved'] = (has_moved and is_moving)
-
-         face_data_point.update({
-            'mode': 'detected',
-            'last_detected_as': face_data_point['feature'],
-            'matches_made': 0,
-            'alive_for': face_data_point.get('alive_for', 0) + 1,
-            'distance': camera.get_distance(curr_s, focal_length)
-         })
-
-      # Set properties for inferred faces
-      for missing_face_data_point in missing_faces_data:
-         missing_face_data_point['mode'] = 'inferred'
-         if 'last_detected_as' not in missing_face_data_point:
-            missing_face_data_point['last_detected_as'] = missing_face_data_point['feature']
-         if 'matches_made' in missing_face_data_point:
-            missing_face_data_point['matches_made'] += 1
-         else:
-            missing_face_data_point['matches_made'] = 1
-
-      # Filter out old inferred faces that are really old
-      missing_faces_data = [data for data in missing_faces_data if data['matches_made'] <= MAX_MATCHES]
-      missing_faces = [data['feature'] for data in missing_faces_data]
+         async_detector = face_detector.AsyncDetector()
 
-      # Infer where missing faces have moved using template matching
-      inferred_faces = []
-      inferred_face_data = []
-      flow = None
-      if last_frame is not None and len(missing_faces) > 0:
-         # there's some faces missing since the last frame, let's find where they went
-         inferred_features = template_matching.template_match_features(last_frame, grey_frame, missing_faces, missing_faces_data)
+   # the size scheduler's span of each detection in flight, to time it against once it's done
+   submitted_spans = {}
 
-         # we've inferred where some of them went, let's update our face data
-         if len(inferred_features) > 0:
-            inferred_faces, inferred_face_data = zip(*inferred_features)
-            faces += inferred_faces
-            face_data += inferred_face_data
+   # optionally, split the frame into tiles that are searched in parallel
+   detection_tiles = config.get('detection_tiles', 1)
+   detection_pool = None
+   if detection_tiles > 1 or detection_scheduler is not None:
+      detection_pool = face_detector.get_pool(config.get('detection_workers'))
 
-      if show_debug:
-         # render pretty face boxes onto the colored frame
-         debug_render.faces(debug_frame, face_data)
+   # optionally, template match missing faces in parallel
+   template_pool = None
+   if config.get('template_workers') is not None:
+      template_pool = template_matching.get_pool(config['template_workers'])
 
-      # detect movement actions from the optic flow and face positions
-      action_regions  = action_detector.get_action_regions(face_data)
+   # where each face was in recent frames, to reconcile late detections
+   track_history = deque(maxlen=config.get('max_detection_lag', 25))
+   frame_count = 0
 
-      if last_frame is not None:
-         # calculate the optic flow of the frame, at a low sample rate
-         flow = action_detector.calc_flow(last_frame, grey_frame)
-
-      if flow is not None and show_debug:
-         # render a pretty flow onto the colored frame
-         debug_render.draw_flow(debug_frame, flow)
-
-      # calculate face velocities
-      for face in face_data:
-         face['v'] = action_detector.get_face_velocity(frame, flow, face)
-
-      if show_debug:
-         debug_render.draw_action_regions(debug_frame, action_regions)
-
-      action_detector.detect_actions(grey_frame, flow, action_regions)
-
-      features_to_send = filter_features(face_data, config.get('max_features', None))
-
-      packed_features = [pack_feature(feature, (frame_w, frame_h)) for feature in features_to_send]
-
-
-      # keep track of the last frame (for flow and template matching)
-      last_frame = grey_frame
-
-      # send the features over the network
-      transport.send_features(packed_features)
-
-      if show_debug:
-         debug_render.draw_actions(debug_frame, action_regions)
-
-         # draw the modified color frame on the screen
-         debug_render.draw_frame(debug_frame)
-
-      frame_index = (frame_index + 1) % len(face_size_ranges)
+   if show_debug:
+      debug_render.init()
 
-   camera.release_cams(cameras)
+   # loop timing, reported on exit
+   stats = {
+      'frames': 0,
+      'idle_frames': 0,
+      'loop_time': 0.0,
+      'latency': 0.0
+   }
+
+   # optionally, skip stages (or whole frames) where nothing in the scene has moved
+   motion_mask = None
+   if config.get('motion_gate') is not None:
+      gate = config['motion_gate']
+      motion_mask = motion.MotionMask(
+         level=gate.get('level', 2),
+         threshold=gate.get('threshold', 15),
+         dilation=gate.get('dilation', 2)
+      )
+      motion_padding = gate.get('padding', 1.0)
+      # a still, empty scene is looked at again after a frame period by default, which
+      # only stops the loop outrunning the cameras, so motion is still caught on the next
+      # frame. Longer intervals save more, but miss the start of whatever moves
+      frame_period = 1.0 / (cameras['clock'].fps if cameras['clock'] is not None else 25.0)
+      idle_interval = gate.get('idle_interval', frame_period)
+
+   # replaying as fast as possible, there's no point waiting while idle
+   is_fast_replay = cameras['clock'] is not None and cameras['clock'].mode == 'fast'
+
+   try:
+      while True:
+         # (there's no window to take keys from in headless mode)
+         if show_debug:
+            key = cv2.waitKey(1) & 0xFF
+            if key == ord('q'):
+               # wait for quit key to be pressed
+               break
+
+         loop_start = time.time()
+
+         camera_frames = camera.read_frames(cameras)
+
+         if camera.sources_finished(cameras):
+            # the recording has been played back
+            break
+
+         if per_camera:
+            if grey_capture:
+               camera_grey_frames = camera_frames
+            else:
+               camera_grey_frames = [camera.greyscale(cam_frame) if cam_frame is not None else None for cam_frame in camera_frames]
+
+         grey_frame = None
+         if not per_camera or not per_camera_flow or show_debug or motion_mask is not None:
+            frame = cameras['compositor'].composite(camera_frames)
+
+            if grey_capture:
+               # cameras were converted to grey as they were captured
+               grey_frame = frame
+            else:
+               grey_frame = camera.greyscale(frame)
+         else:
+            frame = blank_frame
+
+         # brightness sums and scaled down levels of the frame, shared by detection,
+         # template matching and optic flow
+         frame_stats = None
+         frame_pyramid = None
+         if grey_frame is not None:
+            frame_stats = image_stats.ImageStats(grey_frame)
+            frame_pyramid = pyramid.FramePyramid(grey_frame)
+
+         if per_camera:
+            camera_pyramids = [pyramid.FramePyramid(cam_frame) if cam_frame is not None else None for cam_frame in camera_grey_frames]
+
+         scene_has_moved = True
+         if motion_mask is not None:
+            motion_regions = motion_mask.update(frame_pyramid)
+            scene_has_moved = motion_mask.is_moving()
+
+         if show_debug:
+            debug_frame = copy.copy(grey_frame)
+            debug_frame = cv2.cvtColor(debug_frame, cv2.COLOR_GRAY2BGR)
+
+         # a busy async detector won't take this frame, so no size range, sweep or band
+         # of the schedulers is used up on it
+         is_detecting = async_detector is None or async_detector.is_idle()
+
+         if size_scheduler is not None and is_detecting:
+            max_face_size, min_face_size = size_scheduler.next_range()
+            detection_span = size_scheduler.last_span
+         elif size_scheduler is None:
+            max_face_size, min_face_size = face_size_ranges[frame_index]
+
+         detection_regions = None
+         if detection_scheduler is not None and is_detecting:
+            detection_regions = detection_scheduler.regions((frame_h, frame_w), face_data)
+
+         if motion_mask is not None and detection_regions is None:
+            # only look where something has changed, or faces are being tracked
+            detection_regions = face_detector.merge_regions(
+               motion_regions + [face_detector.face_window(face, motion_padding, frame_w, frame_h) for face in face_data]
+            )
+
+         # juggled cameras that weren't read this frame haven't changed, skip them
+         stale_regions = camera.get_regions(cameras, fresh=False)
+         fresh_regions = camera.get_regions(cameras, fresh=True)
+         if len(stale_regions) > 0 and not per_camera:
+            if detection_regions is None:
+               detection_regions = fresh_regions
+            else:
+               detection_regions = face_detector.clip_regions(detection_regions, fresh_regions)
+
+         detection_args = {
+            'scale_factor': face_scale,
+            'max_size': max_face_size,
+            'min_size': min_face_size,
+            'min_height': 25 * min_scale,
+            'regions': detection_regions,
+            'tiles': detection_tiles,
+            'pool': detection_pool
+         }
+
+         if per_camera:
+            # stale cameras are skipped
+            detection_input = [
+               cam_frame if is_fresh else None
+               for cam_frame, is_fresh in zip(camera_grey_frames, cameras['fresh'])
+            ]
+            detection_args['rects'] = camera_rects
+            detect = face_detector.detect_camera_faces
+         else:
+            detection_input = grey_frame
+            detect = face_detector.detect_faces
+
+            if async_detector is None:
+               detection_args['stats'] = frame_stats
+               if pyramid_detection:
+                  detection_args['pyramid'] = frame_pyramid
+
+         # the positions faces are detected at are compared against those of the same frame
+         old_faces = faces
+         displacements = {}
+
+         if multi_tracker is not None:
+            # detections are compared against where the filters expect faces to be
+            multi_tracker.predict()
+            old_faces = predicted_features(multi_tracker, face_data)
+
+         if async_detector is not None:
+            if is_detecting:
+               async_detector.submit(frame_count, detection_input, **detection_args)
+               if size_scheduler is not None:
+                  submitted_spans[frame_count] = detection_span
+
+            detection = async_detector.poll()
+
+            if detection is None:
+               new_faces = None
+            else:
+               detected_index, new_faces, detection_time = detection
+
+               if size_scheduler is not None:
+                  size_scheduler.record(detection_time, submitted_spans.pop(detected_index, None))
+
+               # move each face back to where it was when its frame was captured
+               positions = dict(track_history).get(detected_index, {})
+               old_faces = []
+               for data in face_data:
+                  x, y, size = data['feature']
+                  old_x, old_y, old_size = positions.get(data['id'], data['feature'])
+                  old_faces.append((old_x, old_y, old_size))
+                  displacements[data['id']] = (x - old_x, y - old_y)
+         else:
+            detection_start = time.time()
+            new_faces = detect(detection_input, **detection_args)
+
+            if size_scheduler is not None:
+               size_scheduler.record(1000.0 * (time.time() - detection_start))
+
+         # faces that are followed without counting as missed, while waiting for a detection
+         coasting_faces_data = []
+
+         if new_faces is None:
+            # no detection has finished yet, keep following every face by template matching
+            coasting_faces_data = face_data
+            missing_faces_data = []
+            faces = []
+            face_data = []
+         elif len(new_faces) > 0:
+            # Calculate corresponding features in adjacent frames
+            corresponding_faces = correspondence.correspond(
+               face_data, old_faces, new_faces,
+               method=correspondence_method,
+               # late detections are compared with where faces were, not where they're heading,
+               # and the filters' expectations are already where they're heading
+               predict=len(displacements) == 0 and multi_tracker is None
+            )
+            missing_faces_data = corresponding_faces['missing_features']
+            face_data = corresponding_faces['feature_data']
+
+            # late detections are moved on by how far their face has moved since
+            for data in face_data:
+               if data['id'] in displacements:
+                  x, y, size = data['feature']
+                  dx, dy = displacements[data['id']]
+                  data['feature'] = (x + dx, y + dy, size)
+
+            faces = [data['feature'] for data in face_data]
+         else:
+            missing_faces_data = face_data
+            faces = []
+            face_data = []
+
+         # faces in stale regions weren't looked for, so they carry over unchanged
+         stale_faces_data = []
+         if len(stale_regions) > 0:
+            def is_stale(data):
+               x, y, size = data['feature']
+               return not any(x1 <= x < x2 and y1 <= y < y2 for x1, y1, x2, y2 in fresh_regions)
+
+            stale_faces_data = [data for data in missing_faces_data if is_stale(data)]
+            missing_faces_data = [data for data in missing_faces_data if not is_stale(data)]
+
+         # Reset properties for detected faces
+         for face_data_point in face_data:
+            curr_x, curr_y, curr_s = face_data_point['feature']
+
+            if not face_data_point.get('has_moved', False):
+               has_moved = False
+               if 'last_detected_as' in face_data_point:
+                  last_x, last_y, last_s = face_data_point['last_detected_as']
+                  if ((last_x - curr_x)**2 + (last_y - curr_y)**2) > 10:
+                     has_moved = True
+
+               # see if this face has ever moved
+               is_moving = False
+               if 'v' in face_data_point:
+                  vx, vy = face_data_point['v']
+                  if (vx ** 2 + vy ** 2) > 3:
+                     is_moving = True
+
+               face_data_point['has_moved'] = (has_moved and is_moving)
+
+            face_data_point.update({
+               'mode': 'detected',
+               'last_detected_as': face_data_point['feature'],
+               'matches_made': 0,
+               'alive_for': face_data_point.get('alive_for', 0) + 1,
+               'distance': camera.get_distance(curr_s / camera.camera_scale_at(cameras, curr_x, curr_y), focal_length)
+            })
+
+         if multi_tracker is not None:
+            observe_faces(multi_tracker, face_data)
+
+         if cache_templates:
+            # keep how each detected face looks, to match it by while it goes undetected
+            if per_camera:
+               template_matching.cut_camera_templates(camera_grey_frames, camera_rects, face_data, max_template_size)
+            else:
+               template_matching.cut_templates(grey_frame, face_data, max_template_size)
+
+         # Set properties for inferred faces
+         for missing_face_data_point in missing_faces_data:
+            missing_face_data_point['mode'] = 'inferred'
+            if 'last_detected_as' not in missing_face_data_point:
+               missing_face_data_point['last_detected_as'] = missing_face_data_point['feature']
+            if 'matches_made' in missing_face_data_point:
+               missing_face_data_point['matches_made'] += 1
+            else:
+               missing_face_data_point['matches_made'] = 1
+
+         faces += [data['feature'] for data in stale_faces_data]
+         face_data += stale_faces_data
+
+         # Filter out old inferred faces that are really old
+         missing_faces_data = [data for data in missing_faces_data if data['matches_made'] <= MAX_MATCHES]
+         missing_faces_data += coasting_faces_data
+         missing_faces = [data['feature'] for data in missing_faces_data]
+
+         if multi_tracker is not None and uncertainty_threshold is not None and scene_has_moved and len(missing_faces_data) > 0:
+            # faces whose filters are sure enough where they've gone are moved there,
+            # only the rest are template matched
+            is_certain = multi_tracker.uncertainty([data['filter'] for data in missing_faces_data]) <= uncertainty_threshold
+            is_certain = [
+               certain and data.get('coasted_for', 0) < max_coasted_frames
+               for data, certain in zip(missing_faces_data, is_certain)
+            ]
+            predicted_faces = predicted_features(multi_tracker, missing_faces_data)
+
+            for data, certain, predicted_face in zip(missing_faces_data, is_certain, predicted_faces):
+               if certain:
+                  data['feature'] = predicted_face
+                  data['coasted_for'] = data.get('coasted_for', 0) + 1
+                  faces.append(predicted_face)
+                  face_data.append(data)
+
+            missing_faces_data = [data for data, certain in zip(missing_faces_data, is_certain) if not certain]
+            missing_faces = [face for face, certain in zip(missing_faces, is_certain) if not certain]
+
+         # Infer where missing faces have moved using template matching
+         inferred_faces = []
+         inferred_face_data = []
+         flow = None
+         if not scene_has_moved and len(missing_faces) > 0:
+            # nothing has moved, so the missing faces are where they were
+            faces += missing_faces
+            face_data += missing_faces_data
+         elif per_camera and last_camera_frames is not None and len(missing_faces) > 0:
+            # look for missing faces in the frames of the camera they were in
+            inferred_features = template_matching.template_match_camera_features(
+               last_camera_frames, camera_grey_frames, camera_rects, missing_faces, missing_faces_data,
+               min_deviation=template_min_deviation,
+               pyramids1=last_camera_pyramids, pyramids2=camera_pyramids, coarse_level=template_coarse_level,
+               pool=template_pool, adaptive=adaptive_search, max_template_size=max_template_size,
+               use_templates=cache_templates, max_difference=max_match_difference
+            )
+
+            if len(inferred_features) > 0:
+               inferred_faces, inferred_face_data = zip(*inferred_features)
+               faces += inferred_faces
+               face_data += inferred_face_data
+         elif not per_camera and last_frame is not None and len(missing_faces) > 0:
+            # there's some faces missing since the last frame, let's find where they went
+            inferred_features = template_matching.template_match_features(
+               last_frame, grey_frame, missing_faces, missing_faces_data,
+               stats=last_frame_stats, min_deviation=template_min_deviation,
+               pyramid1=last_frame_pyramid, pyramid2=frame_pyramid, coarse_level=template_coarse_level,
+               pool=template_pool, adaptive=adaptive_search, max_template_size=max_template_size,
+               use_templates=cache_templates, max_difference=max_match_difference
+            )
+
+            # we've inferred where some of them went, let's update our face data
+            if len(inferred_features) > 0:
+               inferred_faces, inferred_face_data = zip(*inferred_features)
+               faces += inferred_faces
+               face_data += inferred_face_data
+
+         if multi_tracker is not None:
+            # template matches are observations too
+            multi_tracker.correct(
+               [data['filter'] for data in inferred_face_data],
+               [data['feature'][:multi_tracker.d] for data in inferred_face_data]
+            )
+            for data in inferred_face_data:
+               data['coasted_for'] = 0
+
+         if show_debug:
+            # render pretty face boxes onto the colored frame
+            debug_render.faces(debug_frame, face_data)
+
+         # detect movement actions from the optic flow and face positions
+         action_regions  = action_detector.get_action_regions(face_data)
+
+         if not scene_has_moved:
+            # there's no flow where nothing moved
+            pass
+         elif per_camera_flow:
+            if last_camera_frames is not None:
+               # calculate the optic flow of each camera, at a low sample rate
+               flow = action_detector.calc_camera_flow(last_camera_pyramids, camera_pyramids, camera_rects, (frame_w, frame_h))
+         elif last_frame is not None:
+            # calculate the optic flow of the frame, at a low sample rate
+            flow = action_detector.calc_flow(last_frame_pyramid, frame_pyramid)
+
+         if flow is not None and show_debug:
+            # render a pretty flow onto the colored frame
+            debug_render.draw_flow(debug_frame, flow)
+
+         # calculate face velocities
+         for face in face_data:
+            face['v'] = action_detector.get_face_velocity(frame, flow, face)
+
+         if show_debug:
+            debug_render.draw_action_regions(debug_frame, action_regions)
+
+         action_detector.detect_actions(frame, flow, action_regions)
+
+         features_to_send = filter_features(face_data, config.get('max_features', None))
+
+         packed_features = [
+            pack_feature(feature, (frame_w, frame_h), camera.camera_scale_at(cameras, *feature['feature'][:2]))
+            for feature in features_to_send
+         ]
+
+
+         # keep track of the last frame (for flow and template matching)
+         last_frame = grey_frame
+         last_frame_stats = frame_stats
+         last_frame_pyramid = frame_pyramid
+         if per_camera:
+            last_camera_frames = camera_grey_frames
+            last_camera_pyramids = camera_pyramids
+
+         if multi_tracker is not None:
+            # drop the filters of faces that weren't followed into this frame
+            followed = set(data['filter'] for data in face_data)
+            multi_tracker.remove_filters([predictor for predictor in multi_tracker.filters if predictor not in followed])
+
+         if size_scheduler is not None:
+            size_scheduler.update(face_data)
+
+         track_history.append((frame_count, dict((data['id'], data['feature']) for data in face_data)))
+         frame_count += 1
+
+         # send the features over the network
+         transport.send_features(packed_features)
+
+         sent_time = time.time()
+         stats['frames'] += 1
+         stats['loop_time'] += sent_time - loop_start
+         if cameras['timestamp'] is not None:
+            stats['latency'] += sent_time - cameras['timestamp']
+
+         if show_debug:
+            debug_render.draw_actions(debug_frame, action_regions)
+
+            # draw the modified color frame on the screen
+            debug_render.draw_frame(debug_frame)
+
+         if is_detecting:
+            frame_index = (frame_index + 1) % len(face_size_ranges)
+
+         if motion_mask is not None and not scene_has_moved and len(face_data) == 0:
+            # an empty, still scene, only look at it every idle_interval seconds
+            stats['idle_frames'] += 1
+            if not is_fast_replay:
+               time.sleep(max(0, idle_interval - (time.time() - loop_start)))
+   finally:
+      # what the capture threads and processes caught and dropped, while they're still there
+      capture_stats = camera.get_capture_stats(cameras)
+
+      # always release the cameras, so capture threads and processes are cleaned up
+      camera.release_cams(cameras)
+
+      if async_detector is not None:
+         async_detector.release()
+
+   if stats['frames'] > 0:
+      print('Processed %d frames, %.2f ms per frame, %.2f ms latency' % (
+         stats['frames'],
+         1000.0 * stats['loop_time'] / stats['frames'],
+         1000.0 * stats['latency'] / stats['frames']
+      ))
+
+   for cam_stats in capture_stats:
+      if 'dropped' in cam_stats:
+         print('Camera %s: %d frames captured, %d dropped' % (cam_stats['source'], cam_stats['captured'], cam_stats['dropped']))
+   stats['capture'] = capture_stats
+
+   return stats
 
 if __name__ == '__main__':
    args = sys.argv[1:]
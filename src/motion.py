@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+
+# Cheap motion detection, by differencing small copies of consecutive frames,
+# so the expensive stages can skip the parts of the scene that haven't changed.
+
+class MotionMask(object):
+   """ Finds the regions of a frame that changed since the frame before
+
+   Frames are differenced at a scaled down level of their pyramid.FramePyramid.
+   update() returns the changed regions (x1, y1, x2, y2) in frame coordinates,
+   every region on the first frame.
+   """
+   def __init__(self, level=2, threshold=15, dilation=2):
+      self.level = level
+      self.threshold = threshold
+      self.dilation = dilation
+      self.last_small = None
+      self.mask = None
+      self.regions = []
+
+   def update(self, frame_pyramid):
+      small = frame_pyramid.level(self.level)
+      frame_h, frame_w = frame_pyramid.shape[:2]
+
+      if self.last_small is None or self.last_small.shape != small.shape:
+         self.last_small = small
+         self.mask = np.full(small.shape[:2], 255, dtype=np.uint8)
+         self.regions = [(0, 0, frame_w, frame_h)]
+         return self.regions
+
+      diff = cv2.absdiff(small, self.last_small)
+      self.last_small = small
+
+      ret, mask = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+      if self.dilation > 0:
+         # join up the changed pixels of a moving thing, and leave room for it to move on
+         mask = cv2.dilate(mask, None, iterations=self.dilation)
+      self.mask = mask
+
+      count, labels, component_stats, centroids = cv2.connectedComponentsWithStats(mask)
+
+      # component 0 is the unchanged background
+      scale_x = frame_w / float(small.shape[1])
+      scale_y = frame_h / float(small.shape[0])
+      self.regions = [
+         (
+            int(x * scale_x),
+            int(y * scale_y),
+            int(min(frame_w, np.ceil((x + w) * scale_x))),
+            int(min(frame_h, np.ceil((y + h) * scale_y)))
+         )
+         for x, y, w, h, area in component_stats[1:]
+      ]
+      return self.regions
+
+   def is_moving(self):
+      return len(self.regions) > 0
@@ -0,0 +1,34 @@
+import cv2
+
+# Per-frame image pyramids. Each level halves the one above it and is only
+# made when first asked for, so detection, optic flow and template matching
+# can share the levels of a frame (and of the frame before it).
+
+class FramePyramid(object):
+   """ Lazily built half-size levels of a frame, level 0 is the frame itself """
+   def __init__(self, img):
+      self.levels = [img]
+
+   @property
+   def shape(self):
+      return self.levels[0].shape
+
+   def level(self, index):
+      while len(self.levels) <= index:
+         above = self.levels[-1]
+         h, w = above.shape[:2]
+         self.levels.append(cv2.resize(above, (int(w/2), int(h/2))))
+      return self.levels[index]
+
+   def level_for(self, size, min_size, max_level=3):
+      # the smallest level at which something of size is still at least min_size
+      index = 0
+      while index < max_level and size / 2.0 ** (index + 1) >= min_size:
+         index += 1
+      return index
+
+def as_pyramid(img):
+   # frames may be passed as arrays or pyramids
+   if isinstance(img, FramePyramid):
+      return img
+   return FramePyramid(img)
@@ -0,0 +1,167 @@
+import cv2
+import numpy as np
+import os
+import queue
+import struct
+import threading
+import time
+
+# Raw video files hold uncompressed frames at a fixed stride, so they can be
+# memory-mapped and any frame sliced out without decoding or copying.
+#
+# layout:
+#    header (HEADER_SIZE bytes): magic, width, height, channels, fps
+#    records: float64 capture timestamp, then the frame's uint8 pixels
+
+RAW_EXTENSION = '.raw'
+
+MAGIC = b'EYERAW01'
+HEADER_FORMAT = '<8sIIId'
+HEADER_SIZE = 64
+
+def record_dtype(width, height, channels):
+   if channels == 1:
+      shape = (height, width)
+   else:
+      shape = (height, width, channels)
+
+   return np.dtype([('timestamp', '<f8'), ('frame', np.uint8, shape)])
+
+def read_header(filename):
+   with open(filename, 'rb') as raw_file:
+      header = raw_file.read(HEADER_SIZE)
+
+   magic, width, height, channels, fps = struct.unpack(HEADER_FORMAT, header[:struct.calcsize(HEADER_FORMAT)])
+
+   if magic != MAGIC:
+      raise ValueError('Not a raw video file: %s' % filename)
+
+   return {
+      'width': width,
+      'height': height,
+      'channels': channels,
+      'fps': fps
+   }
+
+def is_raw_video(source):
+   return isinstance(source, str) and source.endswith(RAW_EXTENSION)
+
+class RawVideoWriter(object):
+   """ Writes frames to a raw video file from a background thread
+
+   Frames are queued by write() and must not be modified afterwards.
+   """
+   def __init__(self, filename, resolution, channels=3, fps=25.0, queue_size=128):
+      width, height = resolution
+
+      self.dtype = record_dtype(width, height, channels)
+      self.frame_shape = self.dtype['frame'].shape
+      self.frames_written = 0
+
+      self.raw_file = open(filename, 'wb')
+      header = struct.pack(HEADER_FORMAT, MAGIC, width, height, channels, fps)
+      self.raw_file.write(header + b'\0' * (HEADER_SIZE - len(header)))
+
+      self.queue = queue.Queue(queue_size)
+      self.thread = threading.Thread(target=self._run)
+      self.thread.daemon = True
+      self.thread.start()
+
+   def _run(self):
+      while True:
+         item = self.queue.get()
+         if item is None:
+            break
+
+         timestamp, frame = item
+         self.raw_file.write(np.float64(timestamp).tobytes())
+         self.raw_file.write(np.ascontiguousarray(frame).data)
+         self.frames_written += 1
+
+   def write(self, frame, timestamp=None):
+      if frame.shape != self.frame_shape:
+         raise ValueError('Frame shape %s does not match %s' % (frame.shape, self.frame_shape))
+
+      if timestamp is None:
+         timestamp = time.time()
+
+      self.queue.put((timestamp, frame))
+
+   def release(self):
+      if self.raw_file is None:
+         return
+
+      self.queue.put(None)
+      self.thread.join()
+      self.raw_file.close()
+      self.raw_file = None
+
+class RawVideoReader(object):
+   """ Memory-maps a raw video file, frames[i] is a view of a frame (no copy) """
+   def __init__(self, filename):
+      header = read_header(filename)
+
+      self.width = header['width']
+      self.height = header['height']
+      self.channels = header['channels']
+      self.fps = header['fps']
+
+      dtype = record_dtype(self.width, self.height, self.channels)
+
+      # a partly written last frame (from an interrupted recording) is ignored
+      count = (os.path.getsize(filename) - HEADER_SIZE) // dtype.itemsize
+
+      if count > 0:
+         self.records = np.memmap(filename, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
+         self.frames = self.records['frame']
+         self.timestamps = self.records['timestamp']
+      else:
+         self.records = None
+         self.frames = np.zeros((0,) + dtype['frame'].shape, dtype=np.uint8)
+         self.timestamps = np.zeros(0)
+
+   def __len__(self):
+      return len(self.frames)
+
+   def release(self):
+      self.records = self.frames = self.timestamps = None
+
+class RawVideoCapture(object):
+   """ Reads a raw video file through the same interface as cv2.VideoCapture """
+   def __init__(self, filename):
+      self.reader = RawVideoReader(filename)
+      self.position = 0
+
+   def grab(self):
+      if self.reader.frames is None or self.position >= len(self.reader):
+         return False
+      self.position += 1
+      return True
+
+   def retrieve(self):
+      return True, self.reader.frames[self.position - 1]
+
+   def read(self):
+      if not self.grab():
+         return False, None
+      return self.retrieve()
+
+   def get(self, prop):
+      reader = self.reader
+      props = {
+         cv2.CAP_PROP_FRAME_WIDTH: reader.width,
+         cv2.CAP_PROP_FRAME_HEIGHT: reader.height,
+         cv2.CAP_PROP_FPS: reader.fps,
+         cv2.CAP_PROP_FRAME_COUNT: len(reader) if reader.frames is not None else 0,
+         cv2.CAP_PROP_POS_FRAMES: self.position
+      }
+      return props.get(prop, 0)
+
+   def set(self, prop, value):
+      return False
+
+   def isOpened(self):
+      return self.reader.frames is not None and self.position < len(self.reader)
+
+   def release(self):
+      self.reader.release()
@@ -1,46 +1,259 @@
 import cv2, numpy as np
+import os
+import image_stats
 
+from concurrent.futures import ThreadPoolExecutor
 from scipy.spatial import cKDTree as KDTree
 
-def template_match_features(frame1, frame2, frame_1_features, frame_1_data=None, scale=1.5):
+# adaptive search margins, in face sizes, and how much of its speed a face
+# could be off its predicted position by
+MIN_MARGIN = 0.25
+MARGIN_GROWTH = 0.05
+VELOCITY_MARGIN = 0.5
+
+# shared pool for matching several features at once
+MATCH_POOL = None
+
+def get_pool(workers=None):
+	global MATCH_POOL
+	if MATCH_POOL is None:
+		MATCH_POOL = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+	return MATCH_POOL
+
+def match_template(search_roi, feature_roi):
+	# the top left of the best match of the feature in the search area, and how
+	# different it is (0 for identical, up to 1)
+	result = cv2.matchTemplate(search_roi, feature_roi, cv2.TM_SQDIFF_NORMED)
+	min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+	return min_loc, min_val
+
+def cut_template(frame, feature, max_template_size=None):
+	# a copy of the feature's image, to match it by until it is detected again, and
+	# a scaled down copy if it's larger than max_template_size
+	x, y, size = feature
+	h, w = frame.shape[:2]
+
+	x1, y1 = int(min(max(0, x - size/2), w)), int(min(max(0, y - size/2), h))
+	x2, y2 = int(min(max(0, x + size/2), w)), int(min(max(0, y + size/2), h))
+	if x2 <= x1 or y2 <= y1:
+		return None
+
+	template = {
+		'image': frame[y1:y2, x1:x2].copy(),
+		# from the feature's centre to the image's top left
+		'offset': (x1 - x, y1 - y),
+		'small': None
+	}
+
+	if max_template_size is not None and size > max_template_size:
+		shrink = max_template_size / float(size)
+		template['small'] = cv2.resize(template['image'], None, fx=shrink, fy=shrink, interpolation=cv2.INTER_AREA)
+		template['shrink'] = shrink
+
+	return template
+
+def cut_templates(frame, frame_data, max_template_size=None):
+	# caches the template of each (just detected) face in its data
+	for data in frame_data:
+		data['template'] = cut_template(frame, data['feature'], max_template_size)
+
+def cut_camera_templates(frames, rects, frame_data, max_template_size=None):
+	# as cut_templates, from the frame of the (topmost) camera each face is in
+	for data in frame_data:
+		x, y, size = data['feature']
+		data['template'] = None
+
+		for frame, (x1, y1, x2, y2) in reversed(list(zip(frames, rects))):
+			if x1 <= x < x2 and y1 <= y < y2:
+				if frame is not None:
+					data['template'] = cut_template(frame, (x - x1, y - y1, size), max_template_size)
+				break
+
+def search_margins(feature, data=None, scale=1.5):
+	# how far past the feature's edges to search for it (x, y), and where to centre
+	# the search. with the feature's data, the search is centred where its velocity
+	# says it should be, and grows with the frames since it was last detected and
+	# with its speed, never past scale times its size. without, the margin is fixed
+	x, y, size = feature
+	max_margin = size * (scale - 0.5)
+
+	if data is None:
+		return x, y, max_margin, max_margin
+
+	vx, vy = data.get('v', (0, 0))
+	margin = size * (MIN_MARGIN + MARGIN_GROWTH * data.get('matches_made', 0))
+
+	return (
+		x + vx,
+		y + vy,
+		min(max_margin, margin + abs(vx) * VELOCITY_MARGIN),
+		min(max_margin, margin + abs(vy) * VELOCITY_MARGIN)
+	)
+
+def template_match_features(frame1, frame2, frame_1_features, frame_1_data=None, scale=1.5, stats=None, min_deviation=None, pyramid1=None, pyramid2=None, coarse_level=1, min_coarse_size=8, pool=None, adaptive=False, max_template_size=None, use_templates=False, max_difference=None):
+	# stats are the image_stats.ImageStats of frame1. with a min_deviation, features
+	# too flat to match reliably (brightness standard deviation below it) are dropped.
+	# with pyramid.FramePyramids of both frames, features are matched coarse to fine:
+	# over the search area at coarse_level, then only around that match at full size.
+	# with a pool, features are matched in parallel.
+	# adaptive searches are sized and placed by search_margins(), from frame_1_data.
+	# features bigger than max_template_size are matched coarse to fine too, on
+	# copies scaled down to that size, when there aren't pyramids to use.
+	# with use_templates, features are matched by the templates cached in their data
+	# (see cut_templates), where they have one, rather than cut from frame1.
+	# each match's difference is kept in its data as 'match_difference', and with a
+	# max_difference, features matching worse than that are dropped
 	new_positions = []
 
 	h, w = frame1.shape
 
+	is_textured = [True] * len(frame_1_features)
+	if stats is not None and min_deviation is not None and len(frame_1_features) > 0:
+		feature_rects = [(x - size/2, y - size/2, x + size/2, y + size/2) for x, y, size in frame_1_features]
+		is_textured = stats.variances(feature_rects) >= min_deviation ** 2
+
+	is_coarse = pyramid1 is not None and pyramid2 is not None and coarse_level > 0
+	factor = 2 ** coarse_level
+
 	# Constrains an x,y value into the width/height of the current frame
 	def constrain(x_val, y_val):
-		new_x = sorted([0, x_val, w])[1]
-		new_y = sorted([0, y_val, h])[1]
+		new_x = int(sorted([0, x_val, w])[1])
+		new_y = int(sorted([0, y_val, h])[1])
 		return new_x, new_y
 	
-	for i, feature in enumerate(frame_1_features):
-		(x, y, size) = feature
+	def match(i):
+		# where feature i went and how different it looks there, or None
+		(x, y, size) = frame_1_features[i]
+		data = frame_1_data[i] if frame_1_data is not None else None
 
 		try:
-			# constrain the feature coordinates to be inside the image
-			x1, y1 = constrain(x - size/2, y - size/2)
-			x2, y2 = constrain(x + size/2, y + size/2)
-
 			# increase the size of the feature to a larger search area
-			# surrounding the feature
-			search_x1, search_y1 = constrain(x - size * scale, y - size * scale)
-			search_x2, search_y2 = constrain(x + size * scale, y + size * scale)
+			# surrounding where the feature should be
+			search_x, search_y, margin_x, margin_y = search_margins(frame_1_features[i], data if adaptive else None, scale)
+			search_x1, search_y1 = constrain(search_x - size/2 - margin_x, search_y - size/2 - margin_y)
+			search_x2, search_y2 = constrain(search_x + size/2 + margin_x, search_y + size/2 + margin_y)
+
+			template = None
+			if use_templates and data is not None:
+				template = data.get('template')
+
+			if template is None:
+				# cut the template from where the feature was in the last frame,
+				# constraining the feature coordinates to be inside the image
+				x1, y1 = constrain(x - size/2, y - size/2)
+				x2, y2 = constrain(x + size/2, y + size/2)
+				template = {'image': frame1[y1:y2, x1:x2], 'offset': (x1 - x, y1 - y), 'small': None}
+
+				if is_coarse and size / factor >= min_coarse_size:
+					# find roughly where the feature went at the coarse level
+					coarse_feature = pyramid1.level(coarse_level)[y1//factor:y2//factor, x1//factor:x2//factor]
+					coarse_search = pyramid2.level(coarse_level)[search_y1//factor:search_y2//factor, search_x1//factor:search_x2//factor]
+					(coarse_x, coarse_y), difference = match_template(coarse_search, coarse_feature)
+					match_x = (coarse_x + search_x1//factor) * factor
+					match_y = (coarse_y + search_y1//factor) * factor
+
+					# then only search a coarse pixel around it
+					search_x1, search_y1 = constrain(match_x - factor, match_y - factor)
+					search_x2, search_y2 = constrain(match_x + (x2 - x1) + factor, match_y + (y2 - y1) + factor)
+				elif max_template_size is not None and size > max_template_size:
+					template['shrink'] = max_template_size / float(size)
+					template['small'] = cv2.resize(template['image'], None, fx=template['shrink'], fy=template['shrink'], interpolation=cv2.INTER_AREA)
+
+			feature_roi = template['image']
+			template_h, template_w = feature_roi.shape[:2]
+
+			if template['small'] is not None:
+				# find roughly where the feature went in scaled down copies
+				shrink = template['shrink']
+				small_search = cv2.resize(frame2[search_y1:search_y2, search_x1:search_x2], None, fx=shrink, fy=shrink, interpolation=cv2.INTER_AREA)
+				(small_x, small_y), difference = match_template(small_search, template['small'])
+				match_x = int(round(small_x / shrink)) + search_x1
+				match_y = int(round(small_y / shrink)) + search_y1
+
+				# then only search a scaled down pixel around it
+				slack = int(np.ceil(1 / shrink))
+				search_x1, search_y1 = constrain(match_x - slack, match_y - slack)
+				search_x2, search_y2 = constrain(match_x + template_w + slack, match_y + template_h + slack)
 
-			# the feature and search area regions of interest
-			feature_roi  = frame1[y1:y2, x1:x2]
 			search_roi = frame2[search_y1:search_y2, search_x1:search_x2]
 
-			# match the feature image in the search area, and gets its x,y position
-			result = cv2.matchTemplate(search_roi, feature_roi, cv2.TM_SQDIFF_NORMED)
-			min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-			(x, y) = (min_loc[0] + search_x1 + size/2, min_loc[1] + search_y1 + size/2)
+			# match the feature image in the search area, and put the feature where it matched
+			min_loc, difference = match_template(search_roi, feature_roi)
+			offset_x, offset_y = template['offset']
+			return (min_loc[0] + search_x1 - offset_x, min_loc[1] + search_y1 - offset_y, size), difference
+		except Exception:
+			return None
+
+	indexes = [i for i in range(len(frame_1_features)) if is_textured[i]]
 
+	# matchTemplate releases the GIL, so matches can run side by side, and map keeps their order
+	if pool is None or len(indexes) < 2:
+		positions = [match(i) for i in indexes]
+	else:
+		if pyramid1 is not None and pyramid2 is not None:
+			# build the coarse levels up front, rather than racing to build them
+			pyramid1.level(coarse_level)
+			pyramid2.level(coarse_level)
+		positions = list(pool.map(match, indexes))
+
+	for i, match_result in zip(indexes, positions):
+		if match_result is None:
+			continue
+
+		position, difference = match_result
+		if max_difference is not None and difference > max_difference:
+			# too weak a match to carry on tracking
+			continue
+
+		if frame_1_data is None:
+			new_positions.append(position)
+		else:
+			frame_1_data[i]['feature'] = position
+			frame_1_data[i]['match_difference'] = difference
+			new_positions.append((position, frame_1_data[i]))
+
+	return new_positions
+
+def template_match_camera_features(frames1, frames2, rects, frame_1_features, frame_1_data=None, scale=1.5, min_deviation=None, pyramids1=None, pyramids2=None, coarse_level=1, pool=None, adaptive=False, max_template_size=None, use_templates=False, max_difference=None):
+	# template matches each feature within the frames of the (topmost) camera it is in,
+	# rects are where each camera sits in the composite, features are in composite coordinates
+	new_positions = []
+	assigned = set()
+
+	if pyramids1 is None or pyramids2 is None:
+		pyramids1 = pyramids2 = [None] * len(rects)
+
+	for frame1, frame2, pyramid1, pyramid2, rect in reversed(list(zip(frames1, frames2, pyramids1, pyramids2, rects))):
+		x1, y1, x2, y2 = rect
+
+		indexes = [
+			i for i, (x, y, size) in enumerate(frame_1_features)
+			if i not in assigned and x1 <= x < x2 and y1 <= y < y2
+		]
+		assigned.update(indexes)
+
+		if frame1 is None or frame2 is None or len(indexes) == 0:
+			continue
+
+		local_features = [(frame_1_features[i][0] - x1, frame_1_features[i][1] - y1, frame_1_features[i][2]) for i in indexes]
+		local_data = None if frame_1_data is None else [frame_1_data[i] for i in indexes]
+
+		stats = None
+		if min_deviation is not None:
+			stats = image_stats.ImageStats(frame1)
+
+		for position in template_match_features(
+			frame1, frame2, local_features, local_data, scale, stats, min_deviation,
+			pyramid1=pyramid1, pyramid2=pyramid2, coarse_level=coarse_level, pool=pool,
+			adaptive=adaptive, max_template_size=max_template_size,
+			use_templates=use_templates, max_difference=max_difference
+		):
 			if frame_1_data is None:
-				new_positions.append((x, y, size))
+				x, y, size = position
+				new_positions.append((x + x1, y + y1, size))
 			else:
-				frame_1_data[i]['feature'] = (x, y, size)
-				new_positions.append(((x, y, size), frame_1_data[i]))
-		except Exception:
-			pass
+				(x, y, size), data = position
+				data['feature'] = (x + x1, y + y1, size)
+				new_positions.append((data['feature'], data))
 
 	return new_positions
@@ -108,7 +108,7 @@ class Filter2D(Filter):
       kalman.processNoiseCov = 1e-4 * np.eye(dps)
       kalman.measurementNoiseCov = 1e-1 * np.eye(mps)
       kalman.errorCovPost = .1 * np.ones((dps, dps))
-      kalman.statePost = .1 * np.random.randn(dps, 1.)
+      kalman.statePost = .1 * np.random.randn(dps, 1)
 
    def observe(self, observation):
       self.last_observation = observation
@@ -163,7 +163,7 @@ class Filter3D(Filter):
       kalman.processNoiseCov = 1e-4 * np.eye(dps)
       kalman.measurementNoiseCov = 1e-1 * np.eye(mps)
       kalman.errorCovPost = .1 * np.ones((dps, dps))
-      kalman.statePost = .1 * np.random.randn(dps, 1.)
+      kalman.statePost = .1 * np.random.randn(dps, 1)
 
    def observe(self, observation):
       self.last_observation = observation
@@ -175,3 +175,264 @@ class Filter3D(Filter):
       self.last_estimate = self.kalman.correct(observation)
       self.last_estimate = tuple(self.last_estimate[:,0])
       return self.last_estimate
+
+
+def motion_model(d):
+   # the transition and measurement matrices of Filter2D (d=2) and Filter3D (d=3):
+   # d positions, then d velocities
+   transition = np.eye(2 * d)
+   transition[:d, d:] = np.eye(d)
+   measurement = np.hstack([np.eye(d), np.eye(d)])
+   return transition, measurement
+
+def invert(matrices):
+   # inverts a stack of matrices, in closed form if they're 2x2 or 3x3 (as the
+   # filters' are), which is much faster than a LAPACK call for each
+   size = matrices.shape[-1]
+   if size == 2:
+      a, b = matrices[:, 0, 0], matrices[:, 0, 1]
+      c, d = matrices[:, 1, 0], matrices[:, 1, 1]
+      inverses = np.stack([d, -b, -c, a], axis=-1).reshape(-1, 2, 2)
+      return inverses / (a * d - b * c)[:, None, None]
+   if size == 3:
+      # the transposed cofactors over the determinant
+      (a, b, c), (d, e, f), (g, h, i) = [[matrices[:, row, column] for column in range(3)] for row in range(3)]
+      cofactors_a, cofactors_b, cofactors_c = e * i - f * h, f * g - d * i, d * h - e * g
+      inverses = np.stack([
+         cofactors_a, c * h - b * i, b * f - c * e,
+         cofactors_b, a * i - c * g, c * d - a * f,
+         cofactors_c, b * g - a * h, a * e - b * d
+      ], axis=-1).reshape(-1, 3, 3)
+      return inverses / (a * cofactors_a + b * cofactors_b + c * cofactors_c)[:, None, None]
+   return np.linalg.inv(matrices)
+
+class BankFilter(object):
+   """ One filter of a FilterBank, a view of its row
+
+   Has the id, last_estimate, last_prediction and confidence() of a filter,
+   so it can be used where one is.
+   """
+   __slots__ = ('bank', 'row', 'id')
+
+   def __init__(self, bank, row):
+      self.bank = bank
+      self.row = row
+      self.id = uuid.uuid1()
+
+   @property
+   def last_estimate(self):
+      return tuple(self.bank.estimates[self.row])
+
+   @property
+   def last_prediction(self):
+      return tuple(self.bank.predictions[self.row])
+
+   def confidence(self):
+      return self.bank.confidence()[self.row]
+
+   def __eq__(self, other):
+      return self.id == other.id
+
+   def __ne__(self, other):
+      return not self.__eq__(other)
+
+   def __hash__(self):
+      return hash(self.id)
+
+class FilterBank(object):
+   """ Filters for many tracks at once, a row each of stacked arrays
+
+   Every filter is predicted, and every observed one corrected, in one batched
+   operation. Subclasses keep their state in the arrays named in self.state.
+   """
+   state = ['estimates', 'predictions']
+
+   def __init__(self, width):
+      self.width = width
+      self.filters = []
+      self.estimates = np.zeros((0, width))
+      self.predictions = np.zeros((0, width))
+
+   def __len__(self):
+      return len(self.filters)
+
+   def init_state(self, observations):
+      # the state arrays of new filters, in the order of self.state
+      raise NotImplementedError
+
+   def add(self, observations):
+      # new filters for each observation, returns their rows
+      observations = np.asarray(observations, dtype=np.float64).reshape(len(observations), -1)
+      first = len(self.filters)
+
+      for name, values in zip(self.state, self.init_state(observations)):
+         if first == 0:
+            # the first filters set the width of observations
+            setattr(self, name, np.array(values))
+         else:
+            setattr(self, name, np.concatenate([getattr(self, name), values]))
+
+      rows = np.arange(first, first + len(observations))
+      self.filters += [BankFilter(self, row) for row in rows]
+      return rows
+
+   def remove(self, rows):
+      keep = np.ones(len(self.filters), dtype=bool)
+      keep[list(rows)] = False
+
+      for name in self.state:
+         setattr(self, name, getattr(self, name)[keep])
+
+      self.filters = [predictor for predictor, kept in zip(self.filters, keep) if kept]
+      for row, predictor in enumerate(self.filters):
+         predictor.row = row
+
+   def predict(self, rows=None):
+      # predicts every filter (or those in rows), returns the predictions
+      raise NotImplementedError
+
+   def observe(self, rows, observations):
+      # corrects the filters in rows with their observations, returns the estimates
+      raise NotImplementedError
+
+   def confidence(self):
+      raise NotImplementedError
+
+   def expected(self, rows=None):
+      # the observations the filters (in rows) expect next
+      raise NotImplementedError
+
+   def uncertainty(self, rows=None):
+      # how unsure each filter (in rows) is of the observation it expects
+      raise NotImplementedError
+
+class SimpleBank(FilterBank):
+   """ SimpleFilters in a bank
+
+   Without a covariance, a filter's uncertainty is how many times it has
+   predicted since it was last observed.
+   """
+   state = ['estimates', 'predictions', 'estimate_last_predictions', 'confidences', 'misses']
+
+   def __init__(self, width=2):
+      super(SimpleBank, self).__init__(width)
+      self.estimate_last_predictions = np.zeros((0, width))
+      self.confidences = np.zeros((0, width))
+      self.misses = np.zeros(0)
+
+   def init_state(self, observations):
+      return observations, observations, observations, np.ones_like(observations), np.zeros(len(observations))
+
+   def predict(self, rows=None):
+      if rows is None:
+         rows = slice(None)
+      velocities = self.estimates[rows] - self.estimate_last_predictions[rows]
+      self.predictions[rows] = self.estimates[rows] + velocities
+      self.estimate_last_predictions[rows] = self.estimates[rows]
+      self.misses[rows] += 1
+      return self.predictions
+
+   def observe(self, rows, observations):
+      self.estimates[rows] = observations
+      self.confidences[rows] = 1
+      self.misses[rows] = 0
+      return self.estimates[rows]
+
+   def confidence(self):
+      return self.confidences
+
+   def expected(self, rows=None):
+      if rows is None:
+         rows = slice(None)
+      return self.predictions[rows]
+
+   def uncertainty(self, rows=None):
+      if rows is None:
+         rows = slice(None)
+      return self.misses[rows]
+
+class KalmanBank(FilterBank):
+   """ Kalman filters, as Filter2D (d=2) or Filter3D (d=3), in a bank
+
+   Predicts and corrects as cv2.KalmanFilter does, with the covariance of each
+   filter stacked in an (n, 2d, 2d) array. The noise defaults are Filter2D's
+   and Filter3D's.
+   """
+   state = ['estimates', 'predictions', 'states', 'covariances', 'states_pre', 'covariances_pre']
+
+   def __init__(self, d=2, process_noise=1e-4, measurement_noise=1e-1):
+      super(KalmanBank, self).__init__(2 * d)
+      self.d = d
+      dps = 2 * d
+
+      self.transition, self.measurement = motion_model(d)
+      self.process_noise = process_noise * np.eye(dps)
+      self.measurement_noise = measurement_noise * np.eye(d)
+
+      self.states = np.zeros((0, dps))
+      self.covariances = np.zeros((0, dps, dps))
+      self.states_pre = np.zeros((0, dps))
+      self.covariances_pre = np.zeros((0, dps, dps))
+
+   def init_state(self, observations):
+      count = len(observations)
+      dps = 2 * self.d
+
+      # start where they were observed, still
+      states = np.zeros((count, dps))
+      states[:, :self.d] = observations[:, :self.d]
+      covariances = .1 * np.ones((count, dps, dps))
+
+      return states, np.zeros((count, dps)), states.copy(), covariances, np.zeros((count, dps)), np.zeros((count, dps, dps))
+
+   def predict(self, rows=None):
+      if rows is None:
+         rows = slice(None)
+      transition = self.transition
+
+      # x' = F x, P' = F P F^T + Q
+      states_pre = self.states[rows].dot(transition.T)
+      covariances_pre = np.matmul(np.matmul(transition, self.covariances[rows]), transition.T) + self.process_noise
+
+      # as cv2.KalmanFilter, the prediction stands until it's corrected
+      self.states_pre[rows] = self.states[rows] = self.predictions[rows] = states_pre
+      self.covariances_pre[rows] = self.covariances[rows] = covariances_pre
+      return self.predictions
+
+   def observe(self, rows, observations):
+      measurement = self.measurement
+      states_pre = self.states_pre[rows]
+      covariances_pre = self.covariances_pre[rows]
+
+      # only the first d values of each observation are measured
+      observations = np.asarray(observations, dtype=np.float64).reshape(len(states_pre), -1)[:, :self.d]
+
+      # the gain K = P' H^T (H P' H^T + R)^-1, as its transpose
+      measured_covariances = np.matmul(measurement, covariances_pre)
+      innovation_covariances = np.matmul(measured_covariances, measurement.T) + self.measurement_noise
+      gains_t = np.matmul(invert(innovation_covariances), measured_covariances)
+
+      innovations = observations - states_pre.dot(measurement.T)
+      states = states_pre + np.einsum('nmd,nm->nd', gains_t, innovations)
+
+      self.states[rows] = self.estimates[rows] = states
+      self.covariances[rows] = covariances_pre - np.matmul(gains_t.transpose(0, 2, 1), measured_covariances)
+      return states
+
+   def confidence(self):
+      # the first row of each filter's error covariance, as Filter.confidence()
+      return self.covariances[:, 0]
+
+   def expected(self, rows=None):
+      # the predicted state, as it would be measured
+      if rows is None:
+         rows = slice(None)
+      return self.states_pre[rows].dot(self.measurement.T)
+
+   def uncertainty(self, rows=None):
+      # the standard deviation of the predicted observation (without the measurement
+      # noise) along its most uncertain axis, from the diagonal of H P' H^T
+      if rows is None:
+         rows = slice(None)
+      measured_covariances = np.matmul(np.matmul(self.measurement, self.covariances_pre[rows]), self.measurement.T)
+      return np.sqrt(np.diagonal(measured_covariances, axis1=1, axis2=2).max(axis=1))
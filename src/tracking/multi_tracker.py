@@ -1,4 +1,4 @@
-from tracking.filters import Filter2D, Filter3D, SimpleFilter
+from tracking.filters import KalmanBank, SimpleBank
 
 import numpy as np
 from scipy.spatial.distance import cdist, pdist
@@ -10,10 +10,22 @@ class MultiTracker(object):
    # add_threshold:     observations must be further away than this distance (pixels)
    #                    to be given their own new predictor
    # d:                 dimensionality (default 2D space), can also be 3D
+   # useKalman:         Kalman filters (as Filter2D/Filter3D) rather than SimpleFilters
+   # process_noise,
+   # measurement_noise: the Kalman filters' noise (variances)
+   #
+   # the filters of all the tracks are kept in one bank (see filters.FilterBank),
+   # and predicted and corrected together
 
    # TODO: make thresholds functions of the prediction (e.g. head size)
-   def __init__(self, remove_threshold=100, add_threshold=50, d=2, useKalman=False):
-      self.filters = []
+   def __init__(self, remove_threshold=100, add_threshold=50, d=2, useKalman=False, process_noise=1e-4, measurement_noise=1e-1):
+      if useKalman:
+         if d not in (2, 3):
+            raise NotImplementedError
+         self.bank = KalmanBank(d, process_noise, measurement_noise)
+      else:
+         self.bank = SimpleBank(d)
+
       self.remove_threshold = remove_threshold
       self.add_threshold = add_threshold
       self.last_id = 0
@@ -26,29 +38,21 @@ class MultiTracker(object):
       self.unassigned = []
       self.useKalman = useKalman
 
-   def make_filter(self, observation):
-      # Create a new filter for this observation
-
-      predictor_filter = None
-
-      if self.useKalman:
-         if self.d == 3:
-            # 3D filter
-            predictor_filter = Filter3D(observation)
-         elif self.d == 2:
-            # 2D filter
-            predictor_filter = Filter2D(observation)
-         else:
-            raise NotImplementedError
-      else:
-         predictor_filter = SimpleFilter(observation)
-
-      predictor_filter.predict()
+   @property
+   def filters(self):
+      return self.bank.filters
 
-      return predictor_filter
+   def add_filters(self, observations):
+      # Create a new filter for each observation, and make its first prediction.
+      # returns the new filters
+      if len(observations) == 0:
+         return []
+      rows = self.bank.add(observations)
+      self.bank.predict(rows)
+      return [self.filters[row] for row in rows]
 
    def add_filter(self, observation):
-      self.filters.append(self.make_filter(observation))
+      self.add_filters([observation])
 
    def is_new_observation(self, observation):
       # ignore observations that have been assigned/recorded
@@ -67,13 +71,37 @@ class MultiTracker(object):
 
    def remove_filters(self, filters):
       # filter out predictors (filters)
-      self.filters = [predictor for pi, predictor in enumerate(self.filters) if predictor not in frozenset(filters)]
+      filters = frozenset(filters)
+      self.bank.remove([pi for pi, predictor in enumerate(self.filters) if predictor in filters])
+
+   def correct(self, filters, observations):
+      # update filters with observations that were paired with them elsewhere
+      if len(filters) > 0:
+         self.bank.observe(self.rows(filters), observations)
+
+   def rows(self, filters):
+      return np.array([predictor.row for predictor in filters], dtype=np.intp)
+
+   def expected(self, filters):
+      # where each of the filters expects its next observation
+      return self.bank.expected(self.rows(filters))[:, :self.d]
+
+   def uncertainty(self, filters):
+      return self.bank.uncertainty(self.rows(filters))
 
    def predict(self):
-      # tell each filter to make a prediction based on current data
-      self.predictions = np.array([predictor.predict()[:self.d] for predictor in self.filters])
+      # tell every filter to make a prediction based on current data
+      self.predictions = self.bank.predict()[:, :self.d]
       return self.predictions
 
+   def estimates(self):
+      # an identifier, the last position estimate and the confidence of each filter
+      confidences = self.bank.confidence()
+      return [
+         (predictor.id, tuple(estimate), tuple(confidence))
+         for predictor, estimate, confidence in zip(self.filters, self.bank.estimates, confidences)
+      ]
+
    def observe(self, observations):
       # update each filter with its closest observation
       # uses a KDTree to calculate closest points
@@ -84,18 +112,14 @@ class MultiTracker(object):
       self.assigned = set()
 
       if len(observations) == 0:
-         predictions = []
-         self.missing = set()
-         for i, predictor in enumerate(self.filters):
-            predictions.append((predictor.id, predictor.last_estimate, tuple(predictor.confidence())))
-            self.missing.add(i)
-         return predictions
+         self.missing = set(range(len(self.filters)))
+         return self.estimates()
 
       self.num_tracking = len(self.filters)
 
       if self.num_tracking == 0:
          # not tracking anything yet, make a bunch of trackers (filters) for each observation
-         self.filters = [self.make_filter(observation) for observation in observations]
+         self.add_filters(observations)
          self.predict()
 
       # Pack all the observation coordinates into a KDTree
@@ -104,7 +128,7 @@ class MultiTracker(object):
       # nearest is a list of the index of the closest observation for each prediction
       # distances is a list of the distance from each observation to each prediction respectively
 
-      self.predictions = np.array([predictor.last_prediction[:self.d] for predictor in self.filters])
+      self.predictions = self.bank.predictions[:, :self.d]
       distances, nearest = observations.query(self.predictions, distance_upper_bound=self.remove_threshold)
 
       predicted_observations = {}
@@ -148,14 +172,18 @@ class MultiTracker(object):
             # mark it as missing
             self.missing.add(pi)
 
-      for pi, observation in assigned_observations.items():
-         self.filters[pi].observe(observation)
-         # mark this observation as having been recorded by a filter
-         self.recorded.add(tuple(observation))
-         self.assigned.add(pi)
+      if len(assigned_observations) > 0:
+         # update every assigned filter at once
+         assigned = list(assigned_observations)
+         self.bank.observe(assigned, np.array([assigned_observations[pi] for pi in assigned]))
+
+         for pi in assigned:
+            # mark this observation as having been recorded by a filter
+            self.recorded.add(tuple(assigned_observations[pi]))
+            self.assigned.add(pi)
 
       # collect any new, orphaned observations as new filters
       self.unassigned = [obs for obs in observations.data if self.is_new_observation(obs)]
 
       # return an identifier and the last position estimate for each prediction
-      return [(predictor.id, predictor.last_estimate, tuple(predictor.confidence())) for predictor in self.filters]
+      return self.estimates()
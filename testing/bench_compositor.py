@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import time
+
+import cv2
+import numpy as np
+
+# Compares camera.Compositor against the float blend_frames implementation,
+# using the recorded clips in place of live cameras.
+#
+# usage: python bench_compositor.py [config.json] [num_frames]
+
+TESTING_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTING_DIR, '..', 'src'))
+
+import camera
+
+CLIPS = ['outputA1.mov', 'outputB1.mov']
+
+args = sys.argv[1:]
+conf_file = args[0] if len(args) > 0 else os.path.join(TESTING_DIR, '..', 'src', 'bicam.json')
+num_frames = int(args[1]) if len(args) > 1 else 50
+
+with open(conf_file) as config_data:
+	config = json.loads(config_data.read())
+
+cameras = sorted(config['cameras'], key=lambda x: x.get('z-index', 0))
+
+for cam_props in cameras:
+	cam_props['placement'] = camera.get_placement(cam_props)
+
+placements = [cam_props['placement'] for cam_props in cameras]
+
+min_x = min(placed['offset'][0] for placed in placements)
+min_y = min(placed['offset'][1] for placed in placements)
+max_x = max(placed['offset'][0] + placed['size'][0] for placed in placements)
+max_y = max(placed['offset'][1] + placed['size'][1] for placed in placements)
+
+cam_setup = {
+	'cameras': cameras,
+	'dimensions': (max_x - min_x, max_y - min_y),
+	'offset': (min_x, min_y)
+}
+
+# load a clip for each camera, at that camera's resolution
+clip_frames = []
+for i, cam_props in enumerate(cameras):
+	capture = cv2.VideoCapture(os.path.join(TESTING_DIR, CLIPS[i % len(CLIPS)]))
+	frames = []
+	while len(frames) < num_frames:
+		is_captured, frame = capture.read()
+		if not is_captured:
+			break
+		frame = cv2.resize(frame, tuple(cam_props['resolution']))
+		frames.append(camera.prepare_frame(cam_props, frame))
+	capture.release()
+	clip_frames.append(frames)
+
+num_frames = min(len(frames) for frames in clip_frames)
+frame_sets = [[frames[i] for frames in clip_frames] for i in range(num_frames)]
+
+compositor = camera.Compositor(cameras, cam_setup['dimensions'], cam_setup['offset'])
+
+start = time.time()
+reference = [camera.blend_frames(cam_setup, frame_set) for frame_set in frame_sets]
+reference_time = time.time() - start
+
+start = time.time()
+for frame_set in frame_sets:
+	compositor.composite(frame_set)
+compositor_time = time.time() - start
+
+mismatches = 0
+for i, frame_set in enumerate(frame_sets):
+	if not np.array_equal(compositor.composite(frame_set), reference[i]):
+		mismatches += 1
+
+print('Frames:', num_frames, 'at', cam_setup['dimensions'])
+print('blend_frames: %.3f ms/frame' % (1000.0 * reference_time / num_frames))
+print('Compositor:   %.3f ms/frame' % (1000.0 * compositor_time / num_frames))
+print('Identical frames: %d/%d' % (num_frames - mismatches, num_frames))
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+# Compares the greedy and optimal correspondence of tracked faces with new
+# detections, for 5, 50 and 500 tracks. Faces are scattered over a crowded
+# frame and move (with a known velocity, plus noise) between frames; a few
+# leave and arrive. Reports time per frame and how many tracks were paired
+# with the right detection.
+#
+# usage: python bench_correspondence.py [repeats]
+
+TESTING_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTING_DIR, '..', 'src'))
+
+import correspondence
+
+TRACK_COUNTS = [5, 50, 500]
+
+# faces per million pixels, so the crowd is as dense however many there are
+DENSITY = 20.0
+
+args = sys.argv[1:]
+repeats = int(args[0]) if len(args) > 0 else 20
+
+def make_frame(random, count):
+	side = np.sqrt(count / DENSITY * 1e6)
+	positions = random.uniform(0, side, (count, 2))
+	sizes = random.uniform(40, 120, count)
+	velocities = random.normal(0, 15, (count, 2))
+
+	old_features = [(x, y, size) for (x, y), size in zip(positions, sizes)]
+	old_data = [{'id': i, 'v': tuple(v)} for i, v in enumerate(velocities)]
+
+	# move each face on, with noise, and lose a tenth of them
+	moved = positions + velocities + random.normal(0, 5, (count, 2))
+	resized = sizes * random.uniform(0.9, 1.1, count)
+	kept = random.permutation(count)[:count - count // 10]
+
+	new_features = [(moved[i][0], moved[i][1], resized[i]) for i in kept]
+	return old_data, old_features, new_features, kept
+
+def run(method, old_data, old_features, new_features):
+	return correspondence.correspond(old_data, old_features, new_features, method=method)
+
+random = np.random.RandomState(0)
+for count in TRACK_COUNTS:
+	frames = [make_frame(random, count) for i in range(repeats)]
+
+	for method in ['greedy', 'optimal']:
+		correct = 0
+		start = time.time()
+		results = [run(method, old_data, old_features, new_features) for old_data, old_features, new_features, kept in frames]
+		elapsed = (time.time() - start) / repeats
+
+		for (old_data, old_features, new_features, kept), result in zip(frames, results):
+			for new_i, data in enumerate(result['feature_data']):
+				if data.get('id') == kept[new_i]:
+					correct += 1
+
+		total = sum(len(kept) for old_data, old_features, new_features, kept in frames)
+		print('%3d tracks  %-8s %8.3f ms/frame  %5.1f%% paired correctly' % (count, method, 1000 * elapsed, 100.0 * correct / total))
@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+import time
+
+import cv2
+import numpy as np
+
+# Compares face detector backends for speed (ms/frame) and recall on the
+# recorded clips. There are no hand labelled faces for the clips, so recall is
+# measured against a reference: the Haar cascade searched exhaustively (small
+# scale steps, few neighbours needed).
+#
+# usage: python bench_detectors.py [detectors.json] [num_frames] [frame_scale]
+#
+# detectors.json maps names to detector configs, as in config.json's "detector",
+# e.g. {"lbp": {"backend": "lbp", "min_neighbors": 2}}
+# Backends whose model files are missing are skipped.
+
+TESTING_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTING_DIR, '..', 'src'))
+
+import face_detector
+
+CLIPS = ['outputA1.mov', 'outputB1.mov']
+
+DETECTORS = {
+	'haar': {'backend': 'haar'},
+	'lbp': {'backend': 'lbp'},
+	'dnn': {
+		'backend': 'dnn',
+		'model': 'res10_300x300_ssd_iter_140000.caffemodel',
+		'config': 'deploy.prototxt'
+	}
+}
+
+REFERENCE = {'backend': 'haar', 'min_neighbors': 3}
+REFERENCE_SCALE_FACTOR = 1.05
+
+SCALE_FACTOR = 1.2
+MAX_SIZE = (300, 300)
+MIN_SIZE = (20, 20)
+
+args = sys.argv[1:]
+detectors = DETECTORS
+if len(args) > 0:
+	with open(args[0]) as detector_data:
+		detectors = json.loads(detector_data.read())
+num_frames = int(args[1]) if len(args) > 1 else 60
+frame_scale = float(args[2]) if len(args) > 2 else 1.0
+
+def overlap(a, b):
+	# intersection over union of rects (x1, y1, x2, y2)
+	inter_w = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+	inter_h = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+	intersection = inter_w * inter_h
+	union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+	return intersection / float(union) if union > 0 else 0
+
+def count_found(reference_rects, rects, threshold=0.3):
+	# how many of the reference rects are matched by a rect
+	unmatched = list(rects)
+	found = 0
+	for reference_rect in reference_rects:
+		overlaps = [overlap(reference_rect, rect) for rect in unmatched]
+		if len(overlaps) > 0 and max(overlaps) > threshold:
+			del unmatched[int(np.argmax(overlaps))]
+			found += 1
+	return found
+
+def detect_all(detector, frames, scale_factor):
+	all_rects = []
+	start = time.time()
+	for frame in frames:
+		all_rects.append([tuple(rect) for rect in detector.detect(frame, scale_factor, MAX_SIZE, MIN_SIZE)])
+	elapsed = time.time() - start
+	return all_rects, 1000.0 * elapsed / max(1, len(frames))
+
+# load the clips as grey frames
+frames = []
+for clip in CLIPS:
+	capture = cv2.VideoCapture(os.path.join(TESTING_DIR, clip))
+	clip_frames = 0
+	while clip_frames < num_frames:
+		is_captured, frame = capture.read()
+		if not is_captured:
+			break
+		if frame_scale != 1.0:
+			frame = cv2.resize(frame, None, fx=frame_scale, fy=frame_scale, interpolation=cv2.INTER_AREA)
+		frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+		clip_frames += 1
+	capture.release()
+
+print('Frames:', len(frames), 'at', frames[0].shape[1], 'x', frames[0].shape[0])
+
+reference_rects, reference_time = detect_all(face_detector.create_detector(REFERENCE), frames, REFERENCE_SCALE_FACTOR)
+num_reference = sum(len(rects) for rects in reference_rects)
+print('Reference faces: %d (%.1f ms/frame)' % (num_reference, reference_time))
+
+for name in sorted(detectors):
+	try:
+		detector = face_detector.create_detector(detectors[name])
+	except (IOError, cv2.error) as e:
+		print('%-8s skipped: %s' % (name, e))
+		continue
+
+	# the first frame loads the model
+	detector.detect(frames[0], SCALE_FACTOR, MAX_SIZE, MIN_SIZE)
+
+	rects, ms_per_frame = detect_all(detector, frames, SCALE_FACTOR)
+	found = sum(count_found(reference, detected) for reference, detected in zip(reference_rects, rects))
+	detections = sum(len(detected) for detected in rects)
+	recall = found / float(num_reference) if num_reference > 0 else 0
+
+	print('%-8s %7.1f ms/frame  recall %5.1f%%  (%d detections)' % (name, ms_per_frame, 100 * recall, detections))
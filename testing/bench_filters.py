@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+# Times a frame of predicting and correcting 1 to 500 tracks' filters: one
+# filter object per track (SimpleFilter, and cv2.KalmanFilter wrapped by
+# Filter2D and Filter3D), called one by one, against a bank of them all
+# (SimpleBank and KalmanBank), predicted and corrected together. Also checks
+# the banks' estimates are the filters'.
+#
+# usage: python bench_filters.py [frames]
+
+TESTING_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTING_DIR, '..', 'src'))
+
+from tracking.filters import Filter2D, Filter3D, SimpleFilter, SimpleBank, KalmanBank
+
+TRACK_COUNTS = [1, 10, 50, 100, 500]
+
+MODELS = [
+	('simple', 2, SimpleFilter, lambda: SimpleBank(2)),
+	('kalman 2d', 2, Filter2D, lambda: KalmanBank(2)),
+	('kalman 3d', 3, Filter3D, lambda: KalmanBank(3))
+]
+
+args = sys.argv[1:]
+num_frames = int(args[0]) if len(args) > 0 else 50
+
+def make_observations(random, count, d):
+	# tracks moving steadily, observed with noise
+	positions = random.uniform(0, 1000, (count, d))
+	velocities = random.normal(0, 5, (count, d))
+	return [positions + velocities * i + random.normal(0, 1, (count, d)) for i in range(num_frames + 1)]
+
+def run_filters(make_filter, observations):
+	filters = [make_filter(observation) for observation in observations[0]]
+
+	start = time.time()
+	for frame_observations in observations[1:]:
+		for predictor in filters:
+			predictor.predict()
+		for predictor, observation in zip(filters, frame_observations):
+			predictor.observe(observation)
+	elapsed = time.time() - start
+
+	return 1000.0 * elapsed / num_frames, np.array([np.asarray(predictor.last_estimate, dtype=np.float64) for predictor in filters])
+
+def run_bank(make_bank, observations):
+	bank = make_bank()
+	rows = bank.add(observations[0])
+
+	start = time.time()
+	for frame_observations in observations[1:]:
+		bank.predict()
+		bank.observe(rows, frame_observations)
+	elapsed = time.time() - start
+
+	return 1000.0 * elapsed / num_frames, bank.estimates
+
+random = np.random.RandomState(0)
+for name, d, make_filter, make_bank in MODELS:
+	for count in TRACK_COUNTS:
+		observations = make_observations(random, count, d)
+
+		filters_ms, filter_estimates = run_filters(make_filter, observations)
+		bank_ms, bank_estimates = run_bank(make_bank, observations)
+
+		print('%-9s %3d tracks  filters %8.3f ms/frame  bank %7.3f ms/frame (%5.1fx)  max difference %.1e' % (
+			name, count, filters_ms, bank_ms, filters_ms / bank_ms,
+			np.abs(filter_estimates - bank_estimates).max()
+		))
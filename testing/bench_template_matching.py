@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# Times template matching of 1, 10 and 50 missing faces between consecutive
+# frames of a recorded clip, one after another and on a thread pool, and checks
+# both give the same positions in the same order.
+#
+# usage: python bench_template_matching.py [workers] [repeats]
+
+TESTING_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTING_DIR, '..', 'src'))
+
+import template_matching
+
+CLIP = 'outputA1.mov'
+FACE_COUNTS = [1, 10, 50]
+
+args = sys.argv[1:]
+workers = int(args[0]) if len(args) > 0 else (os.cpu_count() or 1)
+repeats = int(args[1]) if len(args) > 1 else 20
+
+capture = cv2.VideoCapture(os.path.join(TESTING_DIR, CLIP))
+is_captured, frame1 = capture.read()
+is_captured, frame2 = capture.read()
+capture.release()
+
+frame1 = cv2.cvtColor(frame1, cv2.COLOR_BGR2GRAY)
+frame2 = cv2.cvtColor(frame2, cv2.COLOR_BGR2GRAY)
+h, w = frame1.shape
+
+pool = template_matching.get_pool(workers)
+
+print('Frames: %d x %d, %d workers (%d cpus)' % (w, h, workers, os.cpu_count() or 1))
+
+random = np.random.RandomState(0)
+for count in FACE_COUNTS:
+	sizes = random.uniform(40, 100, count)
+	features = [(float(x), float(y), float(size)) for x, y, size in zip(random.uniform(0, w, count), random.uniform(0, h, count), sizes)]
+
+	start = time.time()
+	for i in range(repeats):
+		sequential = template_matching.template_match_features(frame1, frame2, features)
+	sequential_time = (time.time() - start) / repeats
+
+	start = time.time()
+	for i in range(repeats):
+		parallel = template_matching.template_match_features(frame1, frame2, features, pool=pool)
+	parallel_time = (time.time() - start) / repeats
+
+	print('%2d faces: sequential %7.2f ms, pool %7.2f ms (%.2fx), identical: %s' % (
+		count, 1000 * sequential_time, 1000 * parallel_time,
+		sequential_time / parallel_time, sequential == parallel
+	))
@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+
+import numpy as np
+
+# Runs main.py's tracker engines head to head on the recorded clips: the
+# correspondence engine, which template matches every missing face, and the
+# experimental multi_tracker engine, which pairs detections by its filters and
+# only coasts missing faces on by them when given an uncertainty_threshold (2D
+# and 3D Kalman filters without coasting, and a 2D Kalman filter coasting for a
+# frame). The coasting settings are for comparison, not a recommendation.
+# Each clip is replayed at full resolution through main.main, and for each
+# engine it reports:
+#   ms/frame    main loop time
+#   matched     faces template matched, per frame
+#   sent        faces sent, per frame
+#   ids         tracks followed (fewer, for the same faces, is fewer broken tracks)
+#   error       how far (px) faces that were inferred were from where they were
+#               next detected, mean and 90th percentile
+#
+# usage: python bench_trackers.py [config.json]
+#
+# config.json is the base config, replay.json by default; its cameras are
+# replaced with each clip in turn.
+
+TESTING_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(TESTING_DIR, '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+import main
+import transport
+import template_matching
+
+CLIPS = ['outputA1.mov', 'outputB1.mov']
+RESOLUTION = [1280, 720]
+
+ENGINES = [
+	('correspondence', {'engine': 'correspondence'}),
+	('kalman 2d', {'engine': 'multi_tracker', 'd': 2}),
+	('kalman 3d', {'engine': 'multi_tracker', 'd': 3}),
+	('kalman 2d coast', {'engine': 'multi_tracker', 'd': 2, 'uncertainty_threshold': 5.0, 'max_coasted_frames': 1})
+]
+
+args = sys.argv[1:]
+conf_file = args[0] if len(args) > 0 else os.path.join(SRC_DIR, 'replay.json')
+
+with open(conf_file) as config_data:
+	base_config = json.loads(config_data.read())
+
+# count the faces that are template matched, and keep what's tracked and sent
+counts = {'matched': 0, 'sent': 0}
+tracked = []
+
+def counted(match):
+	def match_counted(*args, **kwargs):
+		result = match(*args, **kwargs)
+		counts['matched'] += len(result)
+		return result
+	return match_counted
+
+template_matching.template_match_features = counted(template_matching.template_match_features)
+template_matching.template_match_camera_features = counted(template_matching.template_match_camera_features)
+
+def count_sent(packed_features):
+	counts['sent'] += len(packed_features)
+transport.send_features = count_sent
+
+filter_features = main.filter_features
+def record_tracked(features, max_features=None):
+	tracked.append([(feature['id'], feature['mode'], feature['feature']) for feature in features])
+	return filter_features(features, max_features)
+main.filter_features = record_tracked
+
+def redetection_errors(frames):
+	# distances from where inferred faces were to where they were next detected
+	errors = []
+	last_inferred = {}
+	for faces in frames:
+		for face_id, mode, (x, y, size) in faces:
+			if mode == 'inferred':
+				last_inferred[face_id] = (x, y)
+			elif face_id in last_inferred:
+				last_x, last_y = last_inferred.pop(face_id)
+				errors.append(np.hypot(x - last_x, y - last_y))
+	return errors
+
+for clip in CLIPS:
+	print(clip)
+
+	for name, tracker in ENGINES:
+		config = dict(base_config, tracker=tracker, cameras=[{
+			'source': os.path.join(TESTING_DIR, clip),
+			'resolution': RESOLUTION,
+			'crop': None,
+			'scale': 1.0,
+			'offset': [0, 0],
+			'blend': None,
+			'z-index': 0
+		}])
+
+		counts['matched'] = 0
+		counts['sent'] = 0
+		del tracked[:]
+
+		# main prints its own timing
+		stdout = sys.stdout
+		sys.stdout = open(os.devnull, 'w')
+		try:
+			stats = main.main(config)
+		finally:
+			sys.stdout.close()
+			sys.stdout = stdout
+
+		frames = max(1, stats['frames'])
+		errors = redetection_errors(tracked)
+		ids = set(face_id for faces in tracked for face_id, mode, feature in faces)
+
+		print('  %-14s %7.1f ms/frame  matched %5.2f  sent %5.2f  ids %3d  error %6.1f px mean %6.1f px p90 (%d)' % (
+			name,
+			1000.0 * stats['loop_time'] / frames,
+			counts['matched'] / float(frames),
+			counts['sent'] / float(frames),
+			len(ids),
+			np.mean(errors) if len(errors) > 0 else 0,
+			np.percentile(errors, 90) if len(errors) > 0 else 0,
+			len(errors)
+		))
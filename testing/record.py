@@ -1,6 +1,18 @@
+import os
+import sys
+import time
 import cv2
 import signal
 
+# usage: python record.py [mov|raw|grey]
+#    mov:  mp4v encoded video (outputA.mov, outputB.mov)
+#    raw:  uncompressed frames, written by background threads (outputA.raw, outputB.raw)
+#    grey: as raw, but greyscale
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import raw_video
+
 width = 1280
 height = 720
 
@@ -10,6 +22,9 @@ PROPS = {
    cv2.CAP_PROP_FPS: 25
 }
 
+args = sys.argv[1:]
+output_format = args[0] if len(args) > 0 else 'mov'
+
 running = True
 def signal_handler(signal, frame):
 	global running
@@ -24,18 +39,49 @@ for prop in PROPS:
 	capture_a.set(prop, PROPS[prop])
 	capture_b.set(prop, PROPS[prop])
 
-fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-video_writer_a = cv2.VideoWriter("outputA.mov", fourcc, 25, (width, height), True)
-video_writer_b = cv2.VideoWriter("outputB.mov", fourcc, 25, (width, height), True)
+if output_format == 'mov':
+	fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+	video_writer_a = cv2.VideoWriter("outputA.mov", fourcc, 25, (width, height), True)
+	video_writer_b = cv2.VideoWriter("outputB.mov", fourcc, 25, (width, height), True)
+else:
+	channels = 1 if output_format == 'grey' else 3
+	video_writer_a = raw_video.RawVideoWriter("outputA" + raw_video.RAW_EXTENSION, (width, height), channels, 25)
+	video_writer_b = raw_video.RawVideoWriter("outputB" + raw_video.RAW_EXTENSION, (width, height), channels, 25)
+
+# cameras may not honour the requested resolution, and the writers only take
+# frames of the size they were opened with, so other sizes are resized to it
+warned = set()
+def fit(frame, name):
+	frame_height, frame_width = frame.shape[:2]
+	if (frame_width, frame_height) == (width, height):
+		return frame
+	if name not in warned:
+		print('Warning: camera %s gives %dx%d frames, resizing them to %dx%d' % (name, frame_width, frame_height, width, height))
+		warned.add(name)
+	return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
 
 frames = 0
 print('Recording...')
 while (capture_a.isOpened() and capture_b.isOpened()) and running:
 	ret_a, frame_a = capture_a.read()
+	time_a = time.time()
 	ret_b, frame_b = capture_b.read()
+	time_b = time.time()
 	if ret_a and ret_b:
-		video_writer_a.write(frame_a)
-		video_writer_b.write(frame_b)
+		frame_a = fit(frame_a, 'A')
+		frame_b = fit(frame_b, 'B')
+
+		if output_format == 'mov':
+			video_writer_a.write(frame_a)
+			video_writer_b.write(frame_b)
+		else:
+			if output_format == 'grey':
+				frame_a = cv2.cvtColor(frame_a, cv2.COLOR_BGR2GRAY)
+				frame_b = cv2.cvtColor(frame_b, cv2.COLOR_BGR2GRAY)
+
+			# queued, and written to disk off the capture thread
+			video_writer_a.write(frame_a, time_a)
+			video_writer_b.write(frame_b, time_b)
 		frames += 1
 
 
@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import itertools
+
+import cv2
+import numpy as np
+
+# Tunes the face detection parameters on the recorded clips. Every combination
+# of scale factor, min neighbours, cascade flags and face size range is run
+# through face_detector.detect_faces, and timed and compared against a slow,
+# thorough reference pass. The fastest combination whose recall (of the
+# reference's faces) meets the target is written, as the "detector" and
+# "detection" sections of a copy of the config, for main.py to load.
+#
+# usage: python tune_detection.py [config.json] [output.json] [target_recall] [num_frames] [frame_scale]
+#
+# frame_scale should bring the clips to the size they are in the composite frame.
+
+TESTING_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(TESTING_DIR, '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+import face_detector
+
+CLIPS = ['outputA1.mov', 'outputB1.mov']
+
+SCALE_FACTORS = [1.1, 1.2, 1.3]
+MIN_NEIGHBORS = [2, 3, 4, 5]
+FLAGS = [
+	['CASCADE_SCALE_IMAGE'],
+	['CASCADE_SCALE_IMAGE', 'CASCADE_DO_CANNY_PRUNING']
+]
+
+# the widest size range searched, and the reference's settings
+MAX_SIZE = 300
+MIN_SIZE = 20
+REFERENCE_SCALE_FACTOR = 1.05
+REFERENCE_MIN_NEIGHBORS = 3
+
+args = sys.argv[1:]
+conf_file = args[0] if len(args) > 0 else os.path.join(SRC_DIR, 'config.json')
+out_file = args[1] if len(args) > 1 else os.path.join(os.path.dirname(conf_file), 'tuned_' + os.path.basename(conf_file))
+target_recall = float(args[2]) if len(args) > 2 else 0.9
+num_frames = int(args[3]) if len(args) > 3 else 30
+frame_scale = float(args[4]) if len(args) > 4 else 0.5
+
+with open(conf_file) as config_data:
+	config = json.loads(config_data.read())
+
+detector_config = dict(config.get('detector', {'backend': 'haar'}))
+if detector_config.get('backend', 'haar') not in ('haar', 'lbp'):
+	print('Only cascade backends can be tuned')
+	sys.exit(1)
+
+def is_same_face(a, b):
+	# face points (x, y, size) that are the same face, give or take
+	ax, ay, a_size = a
+	bx, by, b_size = b
+	return abs(ax - bx) < a_size / 2.0 and abs(ay - by) < a_size / 2.0 and 0.67 < b_size / a_size < 1.5
+
+def count_found(reference_points, points):
+	unmatched = list(points)
+	found = 0
+	for reference_point in reference_points:
+		for i, point in enumerate(unmatched):
+			if is_same_face(reference_point, point):
+				del unmatched[i]
+				found += 1
+				break
+	return found
+
+def run(frames, scale_factor, max_size, min_size, min_neighbors, flags):
+	face_detector.set_detector(face_detector.create_detector(dict(detector_config, min_neighbors=min_neighbors, flags=flags)))
+
+	all_points = []
+	start = time.time()
+	for frame in frames:
+		all_points.append(face_detector.detect_faces(frame, scale_factor=scale_factor, max_size=(max_size, max_size), min_size=(min_size, min_size)))
+	elapsed = time.time() - start
+
+	return all_points, 1000.0 * elapsed / len(frames)
+
+# load the clips as grey frames
+frames = []
+for clip in CLIPS:
+	capture = cv2.VideoCapture(os.path.join(TESTING_DIR, clip))
+	clip_frames = 0
+	while clip_frames < num_frames:
+		is_captured, frame = capture.read()
+		if not is_captured:
+			break
+		if frame_scale != 1.0:
+			frame = cv2.resize(frame, None, fx=frame_scale, fy=frame_scale, interpolation=cv2.INTER_AREA)
+		frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+		clip_frames += 1
+	capture.release()
+
+print('Frames:', len(frames), 'at', frames[0].shape[1], 'x', frames[0].shape[0])
+
+reference_points, reference_time = run(frames, REFERENCE_SCALE_FACTOR, MAX_SIZE, MIN_SIZE, REFERENCE_MIN_NEIGHBORS, FLAGS[0])
+num_reference = sum(len(points) for points in reference_points)
+print('Reference faces: %d (%.1f ms/frame)' % (num_reference, reference_time))
+
+if num_reference == 0:
+	print('No faces to tune against')
+	sys.exit(1)
+
+# size ranges: the widest, and ones fitted around the faces the reference found
+sizes = [size for points in reference_points for x, y, size in points]
+fitted_max = int(min(MAX_SIZE, np.ceil(max(sizes) * 1.25)))
+fitted_min = int(max(MIN_SIZE, np.floor(min(sizes) * 0.8)))
+size_ranges = sorted(set(itertools.product([MAX_SIZE, fitted_max], [MIN_SIZE, fitted_min])), reverse=True)
+
+results = []
+for scale_factor, (max_size, min_size), min_neighbors, flags in itertools.product(SCALE_FACTORS, size_ranges, MIN_NEIGHBORS, FLAGS):
+	points, ms_per_frame = run(frames, scale_factor, max_size, min_size, min_neighbors, flags)
+	found = sum(count_found(reference, detected) for reference, detected in zip(reference_points, points))
+	recall = found / float(num_reference)
+
+	results.append({
+		'scale_factor': scale_factor,
+		'max_size': max_size,
+		'min_size': min_size,
+		'min_neighbors': min_neighbors,
+		'flags': flags,
+		'recall': recall,
+		'ms_per_frame': ms_per_frame
+	})
+
+	print('scale %.2f  sizes %3d-%-3d  neighbours %d  canny %-5s  %6.1f ms/frame  recall %5.1f%%' % (
+		scale_factor, min_size, max_size, min_neighbors,
+		'CASCADE_DO_CANNY_PRUNING' in flags, ms_per_frame, 100 * recall
+	))
+
+passing = [result for result in results if result['recall'] >= target_recall]
+if len(passing) == 0:
+	best = max(results, key=lambda result: result['recall'])
+	print('Nothing reached %.0f%% recall (best was %.1f%%), no config written' % (100 * target_recall, 100 * best['recall']))
+	sys.exit(1)
+
+best = min(passing, key=lambda result: result['ms_per_frame'])
+print('Fastest with %.0f%% recall: %.1f ms/frame, %.1f%% recall' % (100 * target_recall, best['ms_per_frame'], 100 * best['recall']))
+
+config['detector'] = dict(detector_config, min_neighbors=best['min_neighbors'], flags=best['flags'])
+config['detection'] = {
+	'scale_factor': best['scale_factor'],
+	'max_size': best['max_size'],
+	'min_size': best['min_size']
+}
+
+with open(out_file, 'w') as out_data:
+	out_data.write(json.dumps(config, indent='\t') + '\n')
+
+print('Written to', out_file)